@@ -0,0 +1,1317 @@
+"""Headless batch engine for filling a PDF template from CSV data.
+
+Usable without Tk or PIL, either imported or run as ``python -m batch``.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import string
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from itertools import islice
+
+import pymupdf as fitz
+
+from layout import FieldLayout, FontMetrics, LayoutCache
+from preflight import check_rows, undecodable
+from sinks import DirectorySink, WriteBehind, is_directory, open_sink, write_atomic
+
+logger = logging.getLogger('batch')
+
+
+# Field configuration files store the box of every field in PDF points:
+#   {"version": 2, "units": "pt", "fields": [{"name", "page", "x", "y",
+#    "width", "height", "font_size"}, ...]}
+# Version 1 files are a bare list of fields in editor canvas pixels,
+# rendered at 2 pixels per point, always on the first page.
+# A field with "fill": "widget" sets the value of the template's form
+# widget named "widget" (default: the field name) instead of drawing text.
+# Drawn text uses the field's "font": a base-14 name (helv, tiro, ...),
+# a PyMuPDF built-in font (figo, notos, ...) or the path of a TTF/OTF file,
+# and its "fit" policy for values that do not fit (see layout.FIT_POLICIES).
+FIELDS_VERSION = 2
+LEGACY_SCALE = 2
+
+
+def migrate_fields(data):
+    """Return the field list of a configuration, converted to the current schema"""
+    if isinstance(data, list):
+        return [
+            dict(
+                field,
+                page=field.get('page', 0),
+                x=field['x'] / LEGACY_SCALE,
+                y=field['y'] / LEGACY_SCALE,
+                width=field['width'] / LEGACY_SCALE,
+                height=field['height'] / LEGACY_SCALE
+            )
+            for field in data
+        ]
+
+    version = data.get('version')
+    if version != FIELDS_VERSION:
+        raise ValueError(f"Unsupported field configuration version: {version}")
+    return data['fields']
+
+
+def load_field_config(json_path):
+    """Load a field configuration written by PDFViewer.save_fields"""
+    with open(json_path, 'r') as f:
+        return migrate_fields(json.load(f))
+
+
+def save_field_config(json_path, fields):
+    """Write fields in the current schema"""
+    with open(json_path, 'w') as f:
+        json.dump({'version': FIELDS_VERSION, 'units': 'pt', 'fields': fields}, f, indent=4)
+
+
+def default_output_dir(csv_path):
+    """Timestamped output directory next to the CSV file"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base = 'stdin' if csv_path == '-' else os.path.splitext(csv_path)[0]
+    return f"{base}_output_{timestamp}"
+
+
+@contextmanager
+def open_csv(csv_path, errors='strict'):
+    """Open a CSV file for reading, '-' reads from standard input.
+
+    With errors='surrogateescape', bytes that are not UTF-8 are read as
+    lone surrogates instead of raising, so they can be found per row.
+    """
+    if csv_path == '-':
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors=errors, newline='')
+        try:
+            yield f
+        finally:
+            f.detach()
+    else:
+        with open(csv_path, 'r', encoding='utf-8', errors=errors, newline='') as f:
+            yield f
+
+
+def count_csv_rows(csv_path):
+    """Estimate the number of data rows from line breaks, for progress display"""
+    lines = 0
+    last = b'\n'
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(0, lines - 1)  # Header line
+
+
+# Names of per-row outputs, from CSV columns and {index}
+DEFAULT_NAME_TEMPLATE = 'output_{index}.pdf'
+# Characters not allowed in file names on common systems, path separators,
+# and the escapes of bytes that were not UTF-8 (see preflight.undecodable)
+UNSAFE_NAME_CHARS = re.compile(r'[\x00-\x1f<>:"/\\|?*\udc80-\udcff]')
+# Leading dots would make hidden files, or '..'
+LEADING_DOTS = re.compile(r'^\.+')
+# Room left under the usual 255 byte limit for collision suffixes
+MAX_NAME_BYTES = 200
+# Characters of the hash or name per shard directory level
+SHARD_WIDTH = 2
+SHARD_MODES = ('hash', 'prefix')
+
+
+def sanitize_name(value):
+    """A CSV value made safe to put in a file name, without leaving the directory.
+
+    A value missing from a short row (None) becomes '_'.
+    """
+    value = UNSAFE_NAME_CHARS.sub('_', value or '').strip()
+    return LEADING_DOTS.sub('_', value) or '_'
+
+
+class OutputNamer:
+    """File names of per-row outputs, from a template such as "{customer_id}_{date}.pdf".
+
+    Templates can use the CSV columns and {index}; values are sanitized,
+    so a template's own '/' is the only way into a subdirectory. A name
+    given to an earlier row of the run (ignoring case) gets a -2, -3, ...
+    suffix. With shard set, names are spread over SHARD_WIDTH character
+    subdirectories, depth levels deep: 'hash' by a digest of the name,
+    'prefix' by its first characters.
+    """
+    def __init__(self, template=DEFAULT_NAME_TEMPLATE, shard=None, depth=1):
+        if shard is not None and shard not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{shard}', expected one of {', '.join(SHARD_MODES)}")
+        self.template = template
+        self.columns = {
+            field for _, field, _, _ in string.Formatter().parse(template)
+            if field is not None and field != 'index'
+        }
+        if '' in self.columns:
+            raise ValueError("Output name templates need named fields, e.g. {customer_id}")
+        self.shard = shard
+        self.depth = max(1, depth)
+        # Only custom templates can repeat names; hashes of the names
+        # given so far, to stay small over millions of rows
+        self.used = set() if template != DEFAULT_NAME_TEMPLATE else None
+
+    def name(self, i, row):
+        values = {column: sanitize_name(row[column]) for column in self.columns}
+        name = self.template.format_map(dict(values, index=i))
+        base, extension = os.path.splitext(name)
+        if extension.lower() != '.pdf':
+            base, extension = name, '.pdf'
+        while len(base.encode()) > MAX_NAME_BYTES:
+            base = base[:-1]
+        name = base + extension
+
+        if self.used is not None:
+            number = 1
+            while hash(name.casefold()) in self.used:
+                number += 1
+                name = f"{base}-{number}{extension}"
+            self.used.add(hash(name.casefold()))
+
+        if self.shard is None:
+            return name
+        if self.shard == 'hash':
+            key = hashlib.sha256(name.encode()).hexdigest()
+        else:
+            key = os.path.basename(base).casefold().replace('.', '_').ljust(SHARD_WIDTH * self.depth, '_')
+        shards = [key[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(self.depth)]
+        return '/'.join(shards + [name])
+
+    def assign(self, rows):
+        """Pass (index, row) pairs through as (index, row, name), in CSV order"""
+        for i, row in rows:
+            yield i, row, self.name(i, row)
+
+
+# Completed row indexes, one per line, appended as rows finish
+CHECKPOINT_NAME = '.checkpoint'
+
+
+def read_checkpoint(output_dir):
+    """Row indexes recorded as completed in output_dir"""
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        # A crash can leave the last line unfinished
+        return {int(line) for line in f if line.endswith('\n') and line.strip()}
+
+
+# Rows that failed twice, one JSON object per line, with keep_going set
+ERRORS_NAME = 'errors.jsonl'
+
+
+def default_errors_path(output_dir):
+    """Dead-letter file of a run: in its output directory, or next to its archive"""
+    if output_dir == '-':
+        return ERRORS_NAME
+    if is_directory(output_dir):
+        return os.path.join(output_dir, ERRORS_NAME)
+    return f"{output_dir}.{ERRORS_NAME}"
+
+
+def open_checkpoint(output_dir, resume=False):
+    """Open the checkpoint for appending, dropping any unfinished last line.
+
+    A torn line such as "12" of "123" must not be completed into a row
+    index that may never have finished, so it is cut off. Unless resume
+    is set, the rows of an earlier run are dropped too: they may have had
+    other data, and a later --resume must not skip them.
+    """
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    if not resume:
+        return open(path, 'w', buffering=1)
+    if os.path.exists(path):
+        with open(path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            # Lines are short, look back for the last line break
+            keep = 0
+            position = end
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                position = start
+            if keep < end:
+                f.truncate(keep)
+    return open(path, 'a', buffering=1)
+
+
+class DeadLetters:
+    """Rows left out after failing, written as JSON lines as they come in.
+
+    The file is only created once a row fails; one left by an earlier run
+    is removed, since its rows are rendered again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.written = 0
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, failures):
+        """Write the failure records not written yet"""
+        for failure in failures[self.written:]:
+            if self.file is None:
+                # Bytes that were not UTF-8 are kept as \udcXX escapes
+                self.file = open(self.path, 'w', encoding='utf-8', errors='backslashreplace',
+                                 buffering=1)
+            self.file.write(json.dumps(failure, ensure_ascii=False) + "\n")
+        self.written = len(failures)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def remove_partial_files(output_dir):
+    """Delete temporary files left behind by an interrupted run, also in shards"""
+    for directory, _, names in os.walk(output_dir):
+        for name in names:
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+
+
+class Manifest:
+    """Content hashes of the PDFs in an output directory, for incremental runs.
+
+    A row's hash covers its field values, the template file, the field
+    configuration, the font files it names, flattening and subsetting, so an output is current when the stored
+    hash matches. Other columns (and values past the header) do not
+    change the output and are left out.
+
+    Outputs are found by hash as well as by name: when rows are inserted
+    or deleted, the positional output_{i}.pdf names of the rows after them
+    shift, and their outputs are renamed rather than rendered again. An
+    output about to be replaced is moved to a stash directory first, in
+    case a later row has its content.
+    """
+    NAME = '.manifest.json'
+    STASH_NAME = '.stash'
+
+    def __init__(self, output_dir, pdf_path, field_config, flatten=False, subset=True):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, self.NAME)
+        self.hashes = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.hashes = json.load(f)
+        self.seen = set()
+        self.pending = {}
+        self.columns = sorted({field['name'] for field in field_config})
+        # Hash -> names of the outputs holding it, and outputs reused this run
+        self.holders = {}
+        for name, digest in self.hashes.items():
+            self.holders.setdefault(digest, set()).add(name)
+        self.reused = 0
+        self.moved = False
+        # Stashed outputs are not in the manifest, those of an earlier run are stale
+        self.stash = os.path.join(output_dir, self.STASH_NAME)
+        shutil.rmtree(self.stash, ignore_errors=True)
+
+        run = hashlib.sha256()
+        # A font file can change under the same path in the configuration
+        fonts = {field.get('font', DEFAULT_FONT) for field in field_config}
+        paths = [pdf_path] + sorted(spec for spec in fonts
+                                    if spec.lower() not in fitz.Base14_fontdict
+                                    and os.path.isfile(spec))
+        for path in paths:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    run.update(block)
+        run.update(json.dumps(portable_fields(field_config), sort_keys=True).encode())
+        if flatten:
+            run.update(b'flatten')
+        if not subset:
+            run.update(b'no-subset')
+        self.run_hash = run
+
+    def changed(self, rows, skip=()):
+        """Pass through only the (index, row, name) rows whose output is out of date.
+
+        Rows whose index is in skip are taken as done, and left out.
+        """
+        for i, row, name in rows:
+            digest = self.run_hash.copy()
+            digest.update(json.dumps([row.get(column) for column in self.columns]).encode())
+            digest = digest.hexdigest()
+            self.seen.add(name)
+
+            if i in skip:
+                continue
+            if self.hashes.get(name) == digest and os.path.exists(self._path(name)):
+                continue
+            self._release(name)
+            if self._reuse(name, digest):
+                self.reused += 1
+                continue
+            self.pending[i] = (name, digest)
+            yield i, row, name
+
+    def _path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def _stashed(self, digest):
+        return os.path.join(self.stash, f"{digest}.pdf")
+
+    def _moving(self):
+        """Before the first rename, delete the saved manifest until the run saves it.
+
+        Renamed files no longer match the names it lists, and a crash
+        before save must not leave them looking current.
+        """
+        if not self.moved:
+            self.moved = True
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _release(self, name):
+        """Forget the output under name, stashing it unless another output has its hash"""
+        digest = self.hashes.pop(name, None)
+        if digest is None:
+            return
+        holders = self.holders[digest]
+        holders.discard(name)
+        path = self._path(name)
+        if (not os.path.exists(path) or os.path.exists(self._stashed(digest))
+                or any(os.path.exists(self._path(holder)) for holder in holders)):
+            return
+        self._moving()
+        os.makedirs(self.stash, exist_ok=True)
+        os.replace(path, self._stashed(digest))
+
+    def _reuse(self, name, digest):
+        """Give name an existing output with the hash, returns whether there was one.
+
+        Stashed outputs and those of rows not reached yet are moved, those
+        of rows already done this run are copied.
+        """
+        source = self._stashed(digest)
+        move = os.path.exists(source)
+        if not move:
+            holders = [holder for holder in self.holders.get(digest, ())
+                       if os.path.exists(self._path(holder))]
+            if not holders:
+                return False
+            # A row not reached yet can still get its output back by hash
+            unseen = [holder for holder in holders if holder not in self.seen]
+            move = bool(unseen)
+            holder = (unseen or holders)[0]
+            source = self._path(holder)
+            if move:
+                del self.hashes[holder]
+                self.holders[digest].discard(holder)
+
+        self._moving()
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            os.replace(source, path)
+        else:
+            with open(source, 'rb') as f:
+                write_atomic(path, f.read())
+        self.hashes[name] = digest
+        self.holders.setdefault(digest, set()).add(name)
+        return True
+
+    def completed(self, i):
+        name, digest = self.pending.pop(i)
+        self.hashes[name] = digest
+        self.holders.setdefault(digest, set()).add(name)
+
+    def remove_vanished(self):
+        """Delete outputs of rows that are no longer in the CSV, returns how many"""
+        vanished = set(self.hashes) - self.seen
+        for name in vanished:
+            path = os.path.join(self.output_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+            del self.hashes[name]
+        shutil.rmtree(self.stash, ignore_errors=True)
+        return len(vanished)
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.hashes).encode())
+
+
+def read_rows(f, field_config, ignore_extra=False, columns=()):
+    """Validate the CSV header, then lazily yield (index, row) pairs.
+
+    columns are needed besides the fields, e.g. by output names. With
+    ignore_extra set, other columns are allowed and left out of the rows.
+    Only one row is held at a time, so memory does not grow with the file.
+    """
+    reader = csv.DictReader(f)
+    csv_fields = set(reader.fieldnames or [])
+    expected_fields = {field['name'] for field in field_config} | set(columns)
+    missing = expected_fields - csv_fields
+    extra = csv_fields - expected_fields
+
+    if missing or (extra and not ignore_extra):
+        raise ValueError(
+            f"CSV fields don't match form fields.\n"
+            f"Missing fields: {missing}\n"
+            f"Extra fields: {extra}"
+        )
+    rows = enumerate(reader, 1)
+    if extra:
+        # Values past the header (key None) are kept for the pre-flight check
+        rows = (
+            (i, {key: value for key, value in row.items() if key not in extra})
+            for i, row in rows
+        )
+    return rows
+
+
+class StageTimer:
+    """Wall time accumulated per pipeline stage (open, insert, finish, save, write)"""
+    def __init__(self):
+        self.stats = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, count=1):
+        totals = self.stats.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += count
+
+    def take(self):
+        """Return the stats gathered so far and start over"""
+        stats, self.stats = self.stats, {}
+        return stats
+
+    def add(self, stats):
+        """Fold in stats taken from another timer, e.g. a pool process"""
+        for name, (seconds, count) in stats.items():
+            self.record(name, seconds, count)
+
+    def summary(self, rows, elapsed):
+        rate = rows / elapsed if elapsed > 0 else 0
+        lines = [f"{rows} rows in {elapsed:.2f}s ({rate:.1f} rows/s)"]
+        for name, (seconds, count) in self.stats.items():
+            lines.append(
+                f"  {name:<8} {seconds:9.3f}s  {count:8d} calls  "
+                f"{seconds / count * 1000:8.3f} ms/call"
+            )
+        return "\n".join(lines)
+
+
+# Font of fields without a "font" setting
+DEFAULT_FONT = 'figo'
+
+
+class FieldFont:
+    """A font used by fields, read and measured once per run.
+
+    Base-14 fonts are only referenced by name. Other fonts are embedded
+    under their own resource name with page.insert_font, which adds the
+    font file to a document once and shares it between all its pages.
+    """
+    def __init__(self, spec, number):
+        self.spec = spec
+        if spec.lower() in fitz.Base14_fontdict:
+            self.name = spec.lower()
+            self.buffer = None
+            self.metrics = FontMetrics(fitz.Font(self.name), simple=True)
+            return
+
+        self.name = f"fill{number}"
+        try:
+            if os.path.isfile(spec):
+                with open(spec, 'rb') as f:
+                    self.buffer = f.read()
+            else:
+                self.buffer = fitz.Font(spec).buffer
+            self.metrics = FontMetrics(fitz.Font(fontbuffer=self.buffer))
+        except Exception as e:
+            raise ValueError(f"Cannot load font '{spec}': {e}") from e
+
+    def use(self, page):
+        """Add the font to the resources of page, returns its xref (0 for base-14)"""
+        if self.buffer is None:
+            return 0
+        return page.insert_font(fontname=self.name, fontbuffer=self.buffer)
+
+
+class FillPlan:
+    """Template and field geometry compiled once per run.
+
+    The template is read into memory and every field's rectangle is
+    computed up front, grouped by page, so rendering a row only inserts
+    text on the pages that have fields and saves. Widget fields are
+    resolved to their position in the page's widget list, which stays
+    the same in copies of the page (where clashing names get renamed).
+
+    Fonts are loaded once, whichever number of fields use them, and
+    embedded in the in-memory template so every copy of it carries
+    them. With subset set, finished documents only embed the glyphs
+    they use.
+    """
+    def __init__(self, pdf_path, field_config, flatten=False, subset=True):
+        with open(pdf_path, 'rb') as f:
+            self.source = self.template = f.read()
+        self.flatten = flatten
+        self.subset = subset
+
+        doc = fitz.open("pdf", self.template)
+        self.page_count = doc.page_count
+        logger.info("Template %s: %d pages, first page %s x %s",
+                    pdf_path, doc.page_count, doc[0].rect.width, doc[0].rect.height)
+        # Copies of annotations and widgets must stay separate objects
+        self.share_pages = not any(page.first_annot or page.first_widget for page in doc)
+
+        self.pages = {}
+        self.widgets = {}
+        self.fonts = {}
+        self.page_fonts = {}
+        self.layouts = LayoutCache()
+        for field in field_config:
+            page_number = field.get('page', 0)
+            if not 0 <= page_number < self.page_count:
+                raise ValueError(
+                    f"Field '{field['name']}' is on page {page_number + 1}, "
+                    f"but the template has {self.page_count} pages"
+                )
+
+            if field.get('fill', 'text') == 'widget':
+                widget_name = field.get('widget', field['name'])
+                names = [widget.field_name for widget in doc[page_number].widgets()]
+                if widget_name not in names:
+                    raise ValueError(
+                        f"Field '{field['name']}' fills the form widget '{widget_name}', "
+                        f"which is not on page {page_number + 1} of the template"
+                    )
+                logger.debug("Field '%s': widget '%s' on page %d",
+                             field['name'], widget_name, page_number + 1)
+                self.widgets.setdefault(page_number, []).append(
+                    (names.index(widget_name), field['name'])
+                )
+                continue
+
+            x, y = field['x'], field['y']
+            height = field['height']
+
+            # Calculate baseline position (about 80% down from the top of the field)
+            baseline_y = y + height * 0.8
+
+            # Create rectangle for text alignment, extending a field height
+            # either side of the baseline
+            rect = fitz.Rect(
+                x,
+                baseline_y - height,
+                x + field['width'],
+                baseline_y + height
+            )
+
+            spec = field.get('font', DEFAULT_FONT)
+            if spec not in self.fonts:
+                self.fonts[spec] = FieldFont(spec, len(self.fonts))
+            font = self.fonts[spec]
+            page_fonts = self.page_fonts.setdefault(page_number, [])
+            if font not in page_fonts:
+                page_fonts.append(font)
+
+            logger.debug("Field '%s': box (%s, %s) on page %d -> text rect %s, font %s",
+                         field['name'], x, y, page_number + 1, rect, spec)
+            layout = FieldLayout(
+                rect, field['font_size'], font.name, font.metrics,
+                field.get('fit', 'none'), self.layouts
+            )
+            self.pages.setdefault(page_number, []).append((field['name'], layout))
+
+        # Embed the fonts in the in-memory template once, rather than in
+        # every output document. Font files stay uncompressed, as every
+        # output would have to inflate them again to lay out text. Their
+        # ToUnicode maps, which subsetting keeps as they are, are compressed.
+        xrefs = set()
+        for page_number, fonts in self.page_fonts.items():
+            for font in fonts:
+                xrefs.add(font.use(doc[page_number]))
+        for xref in xrefs - {0}:
+            kind, value = doc.xref_get_key(xref, 'ToUnicode')
+            if kind == 'xref':
+                cmap = int(value.split()[0])
+                doc.update_stream(cmap, doc.xref_stream(cmap), compress=True)
+        if self.fonts:
+            self.template = doc.tobytes()
+        doc.close()
+        self._base = None
+
+    def stamp(self, doc, data, first=0):
+        """Insert one row of data onto the template pages starting at first.
+
+        Returns the names of the fields whose value did not fit.
+        """
+        overflowed = []
+        for page_number, fields in self.pages.items():
+            page = doc[first + page_number]
+            # All fields of a page go into one content stream, committed once
+            shape = page.new_shape()
+            for name, layout in fields:
+                # Fitted, and in display order for right-to-left scripts
+                text, font_size, cut = layout.fit(data[name])
+                result = shape.insert_textbox(
+                    layout.rect,
+                    text,
+                    fontsize=font_size,
+                    color=(0, 0, 0),
+                    align=1,  # 1 = center alignment
+                    fontname=layout.fontname
+                )
+                # A negative result is the height missing, nothing was drawn
+                if cut or result < 0:
+                    overflowed.append(name)
+            shape.commit()
+
+        for page_number, fields in self.widgets.items():
+            page = doc[first + page_number]  # Widgets need their page kept alive
+            widgets = list(page.widgets())
+            for position, name in fields:
+                widget = widgets[position]
+                widget.field_value = data[name]
+                widget.update()
+        return overflowed
+
+    def finish(self, doc):
+        """Flatten filled form widgets and subset fonts, as configured"""
+        if self.flatten and self.widgets:
+            doc.bake(annots=False, widgets=True)
+        # Fonts of widgets left fillable must keep every glyph
+        if self.subset and (self.pages or self.flatten):
+            doc.subset_fonts()
+
+    def open(self):
+        """Open a fresh copy of the template from memory"""
+        return fitz.open("pdf", self.template)
+
+    def add_pages(self, doc):
+        """Append the template's pages to doc, returns the first new page number.
+
+        Unless the template has annotations, the copies share the
+        template's content streams, fonts and other resources, and all
+        pages share one copy of each font inserted for the text.
+        """
+        if self._base is None:
+            self._base = fitz.open("pdf", self.source)
+        first = doc.page_count
+        # Keeping the graft map lets later copies reuse objects copied before
+        doc.insert_pdf(self._base, final=not self.share_pages)
+        for page_number, fonts in self.page_fonts.items():
+            for font in fonts:
+                font.use(doc[first + page_number])
+        return first
+
+
+def portable_fields(field_config):
+    """Field settings without editor widget handles, safe to send to workers"""
+    plain = (str, int, float, bool, list, dict, type(None))
+    return [
+        {key: value for key, value in field.items() if isinstance(value, plain)}
+        for field in field_config
+    ]
+
+
+# Rows sent to a worker per task, and tasks kept in flight per worker
+CHUNK_SIZE = 16
+TASKS_PER_WORKER = 4
+
+_worker_processor = None
+
+
+def _init_worker(pdf_path, field_config, merge_rows, flatten, subset, timings, keep_going):
+    """Give each pool process its own parsed template"""
+    global _worker_processor
+    _worker_processor = BatchProcessor(
+        pdf_path,
+        field_config,
+        merge_rows=merge_rows,
+        flatten=flatten,
+        subset=subset,
+        timer=StageTimer() if timings else None,
+        keep_going=keep_going
+    )
+
+
+def _worker_results(outputs):
+    """Outputs rendered, with the stage timings, overflows and failures recorded meanwhile"""
+    processor = _worker_processor
+    timer = processor.timer
+    overflows, processor.overflows = processor.overflows, {}
+    failures, processor.failures = processor.failures, []
+    outputs = [output for output in outputs if output is not None]
+    return outputs, timer.take() if timer else None, overflows, failures
+
+
+def _render_chunk(chunk):
+    """Render (index, row, name) rows in a pool process, to be written by the parent"""
+    return _worker_results([_worker_processor.render_row(*item) for item in chunk])
+
+
+def _merge_chunk(chunk):
+    """Render (index, row) pairs as one merged PDF in a pool process"""
+    return _worker_results([_worker_processor.render_merged(chunk)])
+
+
+class BatchProcessor:
+    """Render CSV rows onto a PDF template.
+
+    By default every row becomes its own output_{i}.pdf, or a file named
+    by name_template and spread over shard subdirectories (see
+    OutputNamer). With merge_rows set, rows are written as consecutive
+    pages of one output.pdf (0), or of output_{first}-{last}.pdf files
+    holding merge_rows rows each.
+
+    Completed rows are recorded in a checkpoint file in the output
+    directory; with resume set, a rerun into the same directory (with the
+    same options) skips them. With incremental set, only rows whose
+    content hash changed since the last run are rendered, and outputs of
+    rows no longer in the CSV are removed.
+
+    Fields set to fill form widgets leave the output a fillable form,
+    unless flatten is set. Embedded fonts are subset unless subset is
+    cleared. CSV columns other than the fields and those used in output
+    names are an error, unless ignore_extra is set.
+
+    A row that fails to render stops the run, unless keep_going is set:
+    then it is retried once, and if it fails again it is left out and
+    recorded with its values and traceback in the errors_path file (by
+    default errors.jsonl in the output directory).
+    """
+    def __init__(self, pdf_path, field_config, workers=1, ordered=True, merge_rows=None,
+                 timer=None, resume=False, incremental=False, flatten=False, subset=True,
+                 name_template=DEFAULT_NAME_TEMPLATE, shard=None, shard_depth=1,
+                 ignore_extra=False, keep_going=False, errors_path=None):
+        if merge_rows is not None and (name_template != DEFAULT_NAME_TEMPLATE or shard):
+            raise ValueError("Output names and shards apply to one file per row, not merged output")
+        self.pdf_path = pdf_path
+        self.field_config = field_config
+        self.workers = workers
+        self.ordered = ordered
+        self.merge_rows = merge_rows
+        self.flatten = flatten
+        self.subset = subset
+        self.timer = timer
+        # Subsetting leaves the whole font files unreferenced and writes
+        # the subsets uncompressed
+        self.save_options = dict(garbage=1, deflate_fonts=True) if subset else {}
+        self.resume = resume
+        self.incremental = incremental
+        self.name_template = name_template
+        self.shard = shard
+        self.shard_depth = shard_depth
+        # Columns the names are made of, also checks the template
+        self.name_columns = OutputNamer(name_template, shard, shard_depth).columns
+        self.ignore_extra = ignore_extra
+        self.keep_going = keep_going
+        self.errors_path = errors_path
+        # Records of the rows left out after failing twice, for this run,
+        # and the file they were written to
+        self.failures = []
+        self.dead_letter_path = None
+        # Row index -> names of fields whose value did not fit, for this run
+        self.overflows = {}
+        self._plan = None
+
+    @property
+    def plan(self):
+        """Fill plan, compiled on first use"""
+        if self._plan is None:
+            with self.stage('compile'):
+                self._plan = FillPlan(
+                    self.pdf_path, self.field_config, self.flatten, self.subset
+                )
+        return self._plan
+
+    def stage(self, name):
+        """Time a pipeline stage when a timer is set"""
+        return self.timer.stage(name) if self.timer else nullcontext()
+
+    def process_pdfs(self, csv_path, output_dir, progress=None, cancel=None):
+        """Create PDFs from CSV data, returns the number of rows rendered.
+
+        output_dir may also name a .zip, .tar or .tar.gz archive, or be '-'
+        for a tar stream on standard output (see sinks.open_sink). progress
+        is called with the running count after every row is written;
+        setting the cancel event stops the run once the rows in progress
+        are done.
+        """
+        if self.incremental and self.merge_rows is not None:
+            raise ValueError("Incremental runs need one output file per row, not merged output")
+        if (self.resume or self.incremental) and not is_directory(output_dir):
+            raise ValueError("Resumed and incremental runs need an output directory")
+
+        # Keeping going, a row with bytes that are not UTF-8 is left out
+        # like any other bad row, rather than ending the run
+        with open_csv(csv_path, 'surrogateescape' if self.keep_going else 'strict') as f:
+            rows = read_rows(f, self.field_config, self.ignore_extra, self.name_columns)
+            if self.merge_rows is None:
+                # Named in CSV order over every row, so a collision suffix
+                # stays with the same row when others are skipped
+                rows = OutputNamer(self.name_template, self.shard, self.shard_depth).assign(rows)
+
+            # Create the output directory or archive
+            sink = open_sink(output_dir)
+            directory = isinstance(sink, DirectorySink)
+
+            skip = set()
+            if self.resume:
+                remove_partial_files(output_dir)
+                skip = read_checkpoint(output_dir)
+                if skip:
+                    logger.info("Resuming, %d rows already completed", len(skip))
+
+            manifest = None
+            if self.incremental:
+                manifest = Manifest(output_dir, self.pdf_path, self.field_config, self.flatten,
+                                    self.subset)
+                # Completed rows are left alone, not moved or renamed
+                rows = manifest.changed(rows, skip)
+            elif skip:
+                rows = (item for item in rows if item[0] not in skip)
+
+            dead_letters = None
+            if self.keep_going:
+                dead_letters = DeadLetters(self.errors_path or default_errors_path(output_dir))
+            rows = self.screen_rows(rows)
+
+            # Process each row
+            count = 0
+            finished = False
+            with open_checkpoint(output_dir, self.resume) if directory else nullcontext() as checkpoint:
+                completed = self.render_rows(rows, sink)
+                try:
+                    for i in completed:
+                        if dead_letters:
+                            dead_letters.write(self.failures)
+                        if checkpoint:
+                            checkpoint.write(f"{i}\n")
+                        if manifest:
+                            manifest.completed(i)
+                        count += 1
+                        if progress:
+                            progress(count)
+                        if cancel is not None and cancel.is_set():
+                            break
+                    else:
+                        finished = True
+                finally:
+                    completed.close()
+                    sink.close()
+                    if dead_letters:
+                        dead_letters.write(self.failures)
+                        dead_letters.close()
+                    if manifest:
+                        # Only a complete pass knows which rows are gone
+                        if finished:
+                            removed = manifest.remove_vanished()
+                            logger.info("Incremental run: %d rows unchanged (%d outputs renamed "
+                                        "or copied), %d outputs removed",
+                                        len(manifest.seen) - count, manifest.reused, removed)
+                        manifest.save()
+
+        if self._plan is not None:
+            layouts = self._plan.layouts
+            logger.debug("Layout cache: %d hits, %d misses", layouts.hits, layouts.misses)
+        if self.overflows:
+            logger.warning("%d rows have values that did not fit their field", len(self.overflows))
+        if self.failures:
+            logger.warning("%d rows failed and were left out, see %s",
+                           len(self.failures), dead_letters.path)
+            self.dead_letter_path = dead_letters.path
+        return count
+
+    def preflight(self, csv_path):
+        """Check every row of a CSV file without rendering, returns a PreflightReport"""
+        if csv_path == '-':
+            raise ValueError("Pre-flight checks need a CSV file, standard input can only be read once")
+        plan = self.plan
+        fields = [(name, layout) for fields in plan.pages.values() for name, layout in fields]
+        fields += [(name, None) for widgets in plan.widgets.values() for _, name in widgets]
+        with self.stage('preflight'):
+            # Invalid UTF-8 is reported rather than raised
+            with open(csv_path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+                return check_rows(
+                    read_rows(f, self.field_config, self.ignore_extra, self.name_columns), fields
+                )
+
+    def render_rows(self, rows, sink):
+        """Render rows into sink, yielding each index once written.
+
+        Outputs are written behind the rendering by I/O threads, so a
+        slow sink only holds rendering up when the write queue is full.
+        """
+        writer = WriteBehind(sink, self.ordered, timer=self.timer)
+        try:
+            for name, content, done in self.render_outputs(rows):
+                writer.put(name, content, done)
+                yield from writer.completed()
+            yield from writer.drain()
+        finally:
+            writer.close()
+
+    def render_outputs(self, rows):
+        """Render rows, yielding (name, content, indexes) per output file.
+
+        Rows are (index, row, name) for one file per row, (index, row) pairs
+        when merging.
+        """
+        if self.merge_rows is not None:
+            yield from self._render_merged(rows)
+            return
+
+        if self.workers > 1:
+            yield from self._render_parallel(rows, CHUNK_SIZE, _render_chunk)
+            return
+
+        for i, row, name in rows:
+            output = self.render_row(i, row, name)
+            if output is not None:
+                yield output
+
+    def screen_rows(self, rows):
+        """Pass rows through, recording malformed ones in failures instead.
+
+        Without keep_going, a row with fewer values than the header raises
+        ValueError and other rows are passed through as they are.
+        """
+        for item in rows:
+            i, row = item[0], item[1]
+            if None in row.values():
+                if not self.keep_going:
+                    raise ValueError(f"Row {i} has fewer values than header columns")
+                error = "ValueError: fewer values than header columns"
+            elif not self.keep_going:
+                yield item
+                continue
+            elif None in row:
+                error = f"ValueError: {len(row[None])} more values than header columns"
+            elif any(undecodable(value) for value in row.values() if value):
+                error = "UnicodeDecodeError: values are not valid UTF-8"
+            else:
+                yield item
+                continue
+            logger.info("Row %d is malformed, leaving it out: %s", i, error)
+            self.failures.append({'row': i, 'values': row, 'error': error, 'traceback': None})
+
+    def attempt(self, i, row, render):
+        """Call render for a row, returns its result.
+
+        With keep_going set, a failure is retried once; a second one is
+        recorded in failures and None is returned.
+        """
+        try:
+            return render()
+        except Exception as e:
+            if not self.keep_going:
+                raise
+            logger.info("Row %d failed, retrying: %s", i, e)
+        try:
+            return render()
+        except Exception as e:
+            logger.info("Row %d failed again, leaving it out: %s", i, e)
+            self.failures.append({
+                'row': i,
+                'values': row,
+                'error': f"{type(e).__name__}: {e}",
+                'traceback': traceback.format_exc()
+            })
+            return None
+
+    def render_row(self, i, row, name):
+        """Render one row as its own output, noting fields that overflowed.
+
+        Returns None for a row left out after failing (see attempt).
+        """
+        rendered = self.attempt(i, row, lambda: self.render_pdf(row))
+        if rendered is None:
+            return None
+        content, overflowed = rendered
+        if overflowed:
+            self.overflows[i] = overflowed
+        return name, content, [i]
+
+    def _render_merged(self, rows):
+        """Render rows into merged outputs"""
+        # Chunks are independent files, so they can go to the pool
+        if self.workers > 1 and self.merge_rows:
+            yield from self._render_parallel(rows, self.merge_rows, _merge_chunk)
+            return
+
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.merge_rows)) if self.merge_rows else rows
+            output = self.render_merged(chunk)
+            if output is None:
+                break
+            yield output
+            if not self.merge_rows:
+                break
+
+    def _render_parallel(self, rows, chunk_size, task):
+        """Spread rows over a process pool, keeping a bounded number in flight"""
+        max_pending = self.workers * TASKS_PER_WORKER
+        pending = deque()
+        rows = iter(rows)
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(
+                self.pdf_path,
+                portable_fields(self.field_config),
+                self.merge_rows,
+                self.flatten,
+                self.subset,
+                self.timer is not None,
+                self.keep_going
+            )
+        ) as pool:
+            try:
+                while True:
+                    chunk = list(islice(rows, chunk_size))
+                    if chunk:
+                        pending.append(pool.submit(task, chunk))
+                    if not pending:
+                        break
+                    if chunk and len(pending) < max_pending:
+                        continue
+
+                    if self.ordered:
+                        finished = [pending.popleft()]
+                    else:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            pending.remove(future)
+
+                    for future in finished:
+                        outputs, stats, overflows, failures = future.result()
+                        if stats:
+                            self.timer.add(stats)
+                        self.overflows.update(overflows)
+                        self.failures.extend(failures)
+                        yield from outputs
+            finally:
+                # Stopped early: drop queued chunks, let running ones finish
+                for future in pending:
+                    future.cancel()
+
+    def render_pdf(self, data):
+        """Render one row to PDF bytes, with the fields whose value did not fit"""
+        plan = self.plan
+        with self.stage('open'):
+            doc = plan.open()
+        with self.stage('insert'):
+            overflowed = plan.stamp(doc, data)
+        with self.stage('finish'):
+            plan.finish(doc)
+        with self.stage('save'):
+            content = doc.tobytes(**self.save_options)
+        doc.close()
+        return content, overflowed
+
+    def create_filled_pdf(self, data, output_path):
+        """Create a single filled PDF, returns the fields whose value did not fit"""
+        content, overflowed = self.render_pdf(data)
+        with self.stage('write'):
+            write_atomic(output_path, content)
+        return overflowed
+
+    def add_row(self, doc, row):
+        """Append one row's pages to a merged document, returns the fields that overflowed.
+
+        On failure the pages added for the row are removed again.
+        """
+        plan = self.plan
+        first = doc.page_count
+        try:
+            with self.stage('open'):
+                plan.add_pages(doc)
+            with self.stage('insert'):
+                return plan.stamp(doc, row, first)
+        except Exception:
+            if doc.page_count > first:
+                doc.delete_pages(first, doc.page_count - 1)
+            raise
+
+    def render_merged(self, rows):
+        """Render (index, row) pairs as pages of one PDF.
+
+        Returns (name, content, indexes), or None when there are no rows.
+        """
+        doc = fitz.open()
+        done = []
+        for i, row in rows:
+            overflowed = self.attempt(i, row, lambda: self.add_row(doc, row))
+            if overflowed is None:
+                continue
+            if overflowed:
+                self.overflows[i] = overflowed
+            done.append(i)
+
+        output = None
+        if done:
+            with self.stage('finish'):
+                self.plan.finish(doc)
+            if self.merge_rows:
+                name = f"output_{done[0]}-{done[-1]}.pdf"
+            else:
+                name = "output.pdf"
+            with self.stage('save'):
+                content = doc.tobytes(garbage=1, deflate=True)
+            output = (name, content, done)
+            logger.info("Rendered %s (%d rows)", name, len(done))
+        doc.close()
+        return output
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m batch',
+        description="Fill a PDF template with rows from a CSV file."
+    )
+    parser.add_argument('pdf', help="template PDF")
+    parser.add_argument('fields', help="field configuration JSON (from Save Fields)")
+    parser.add_argument('csv', help="CSV data file, or - to read standard input")
+    parser.add_argument('-o', '--output-dir',
+                        help="output directory, .zip/.tar/.tar.gz archive, or - for a tar "
+                             "stream on standard output (default: <csv>_output_<timestamp>)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="number of rendering processes (default: 1)")
+    parser.add_argument('--unordered', action='store_true',
+                        help="report rows as they finish rather than in CSV order")
+    parser.add_argument('--merge', action='store_true',
+                        help="write all rows as pages of a single output.pdf")
+    parser.add_argument('--merge-rows', type=int, metavar='N',
+                        help="write merged files of N rows each (implies --merge)")
+    parser.add_argument('--name', dest='name_template', default=DEFAULT_NAME_TEMPLATE,
+                        metavar='TEMPLATE',
+                        help="output file name from CSV columns and {index}, e.g. "
+                             "'{customer_id}_{date}.pdf' (default: %(default)s)")
+    parser.add_argument('--shard', choices=SHARD_MODES,
+                        help="spread outputs over subdirectories by a hash or the "
+                             "first characters of their name")
+    parser.add_argument('--shard-depth', type=int, default=1, metavar='N',
+                        help="levels of shard subdirectories (default: 1)")
+    parser.add_argument('--ignore-extra-columns', dest='ignore_extra', action='store_true',
+                        help="allow CSV columns that are not fields, and leave them out")
+    parser.add_argument('--preflight', action='store_true',
+                        help="check every row for missing values, invalid UTF-8, values that "
+                             "do not fit and characters the font lacks; render only if none")
+    parser.add_argument('--check', action='store_true',
+                        help="only run the --preflight check and print its report")
+    parser.add_argument('--keep-going', action='store_true',
+                        help="retry a failing row once, then leave it out and record it "
+                             "instead of stopping the run")
+    parser.add_argument('--errors', dest='errors_path', metavar='FILE',
+                        help="JSON lines file for rows left out by --keep-going "
+                             f"(default: {ERRORS_NAME} in the output directory)")
+    parser.add_argument('--flatten', action='store_true',
+                        help="flatten filled form widgets into the page content")
+    parser.add_argument('--no-subset', dest='subset', action='store_false',
+                        help="embed fonts whole instead of only the glyphs used")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip rows already completed in the output directory "
+                             "by an earlier run with the same options (needs -o)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only render rows that changed since the last run into "
+                             "the same output directory, and remove vanished ones (needs -o)")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="log progress (-v) or per-field details (-vv)")
+    parser.add_argument('--timings', action='store_true',
+                        help="print time spent per stage at the end of the run")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if (args.resume or args.incremental) and not args.output_dir:
+        parser.error("--resume and --incremental need the output directory of the earlier run (-o)")
+    if (args.resume or args.incremental) and not is_directory(args.output_dir):
+        parser.error("--resume and --incremental need an output directory, not an archive")
+    logging.basicConfig(
+        level=max(logging.DEBUG, logging.WARNING - 10 * args.verbose),
+        format="%(levelname)s %(name)s: %(message)s"
+    )
+    output_dir = args.output_dir or default_output_dir(args.csv)
+
+    merge_rows = None
+    if args.merge_rows:
+        merge_rows = max(1, args.merge_rows)
+    elif args.merge:
+        merge_rows = 0
+
+    try:
+        processor = BatchProcessor(
+            args.pdf,
+            load_field_config(args.fields),
+            workers=max(1, args.workers),
+            ordered=not args.unordered,
+            merge_rows=merge_rows,
+            timer=StageTimer() if args.timings else None,
+            resume=args.resume,
+            incremental=args.incremental,
+            flatten=args.flatten,
+            subset=args.subset,
+            name_template=args.name_template,
+            shard=args.shard,
+            shard_depth=args.shard_depth,
+            ignore_extra=args.ignore_extra,
+            keep_going=args.keep_going,
+            errors_path=args.errors_path
+        )
+        start = time.perf_counter()
+        if args.preflight or args.check:
+            report = processor.preflight(args.csv)
+            print(report.summary(), file=sys.stdout if args.check else sys.stderr)
+            if args.check or not report.ok:
+                return 0 if report.ok else 1
+        count = processor.process_pdfs(args.csv, output_dir)
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        logger.debug("Batch failed", exc_info=True)
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if processor.timer:
+        print(processor.timer.summary(count, elapsed), file=sys.stderr)
+    for i, names in sorted(processor.overflows.items()):
+        print(f"Row {i}: {', '.join(names)} did not fit", file=sys.stderr)
+    if output_dir == '-':
+        # Standard output carries the PDFs themselves
+        print(f"{count} rows have been written to standard output", file=sys.stderr)
+    else:
+        print(f"{count} rows have been rendered into: {output_dir}")
+    if processor.failures:
+        print(f"{len(processor.failures)} rows failed and were left out, "
+              f"see {processor.dead_letter_path}", file=sys.stderr)
+        return 2  # Partial success
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
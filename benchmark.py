@@ -0,0 +1,218 @@
+"""Benchmark harness for the batch fill pipeline.
+
+Generates synthetic templates, field configurations and CSV files, runs
+BatchProcessor.process_pdfs on them and reports rows/sec, peak RSS and
+output bytes per row. Run with ``python -m benchmark --help``.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pymupdf as fitz
+
+from batch import BatchProcessor
+
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+HEBREW = "אבגדהוזחטיכלמנסעפצקרשת"
+
+MODES = ('serial', 'parallel', 'merged')
+
+
+def make_template(path, pages, embedded_font):
+    """Write an A4 template with some body text on every page"""
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        fontname = "figo" if embedded_font else "helv"
+        page.insert_text((72, 72), f"Synthetic template, page {number + 1}",
+                         fontsize=14, fontname=fontname)
+        for line in range(20):
+            page.insert_text((72, 120 + line * 30), "Lorem ipsum " * 6,
+                             fontsize=9, fontname=fontname)
+    doc.save(path)
+    doc.close()
+
+
+# Field grid of the generated templates, in points
+FIELD_WIDTH = 200
+FIELD_HEIGHT = 20
+FIELD_GAP = 10
+MARGIN = 50
+
+
+def make_fields(count, pages):
+    """Field configuration in PDF points, in a grid spread evenly over the pages.
+
+    Columns get narrower as fields are added, so every box stays on its page.
+    """
+    page_rect = fitz.paper_rect('a4')  # Size of the pages make_template adds
+    lines = int((page_rect.height - 2 * MARGIN + FIELD_GAP) // (FIELD_HEIGHT + FIELD_GAP))
+    per_page = max(1, -(-count // pages))
+    columns = -(-per_page // lines)
+    width = min(FIELD_WIDTH, (page_rect.width - 2 * MARGIN + FIELD_GAP) / columns - FIELD_GAP)
+
+    fields = []
+    for i in range(count):
+        page, slot = divmod(i, per_page)
+        column, line = divmod(slot, lines)
+        fields.append({
+            'name': f"field_{i + 1}",
+            'page': page,
+            'x': MARGIN + column * (width + FIELD_GAP),
+            'y': MARGIN + line * (FIELD_HEIGHT + FIELD_GAP),
+            'width': width,
+            'height': FIELD_HEIGHT,
+            'font_size': 11
+        })
+    return fields
+
+
+def make_csv(path, fields, rows, text_length, rtl, seed=0):
+    """Write random values for every field; rtl mixes Hebrew words and numbers"""
+    rng = random.Random(seed)
+    alphabet = HEBREW if rtl else LATIN
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([field['name'] for field in fields])
+        for _ in range(rows):
+            row = []
+            for _ in fields:
+                text = ''.join(rng.choice(alphabet) for _ in range(text_length))
+                if rtl:
+                    text = f"{text[:text_length // 2]} {rng.randint(1, 999)}"
+                row.append(text)
+            writer.writerow(row)
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and its finished children, in MB"""
+    scale = 1 if sys.platform == 'darwin' else 1024  # Bytes on macOS, KB elsewhere
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / (1024 * 1024)
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_case(case, workdir, workers):
+    """Build the inputs for one case and time a batch run over them"""
+    name = f"p{case['pages']}_f{case['fields']}_r{case['rows']}_t{case['text_length']}"
+    if case['rtl']:
+        name += '_rtl'
+    if case['embedded_font']:
+        name += '_font'
+    pdf_path = os.path.join(workdir, f"{name}.pdf")
+    csv_path = os.path.join(workdir, f"{name}.csv")
+    output_dir = os.path.join(workdir, f"{name}_{case['mode']}")
+
+    if not os.path.exists(pdf_path):
+        make_template(pdf_path, case['pages'], case['embedded_font'])
+    fields = make_fields(case['fields'], case['pages'])
+    if not os.path.exists(csv_path):
+        make_csv(csv_path, fields, case['rows'], case['text_length'], case['rtl'])
+
+    processor = BatchProcessor(
+        pdf_path,
+        fields,
+        workers=workers if case['mode'] == 'parallel' else 1,
+        merge_rows=0 if case['mode'] == 'merged' else None
+    )
+    start = time.perf_counter()
+    count = processor.process_pdfs(csv_path, output_dir)
+    elapsed = time.perf_counter() - start
+
+    output_bytes = directory_bytes(output_dir)
+    shutil.rmtree(output_dir)
+    return dict(
+        case,
+        name=name,
+        seconds=elapsed,
+        rows_per_sec=count / elapsed if elapsed > 0 else 0,
+        peak_rss_mb=peak_rss_mb(),
+        bytes_per_row=output_bytes / count if count else 0
+    )
+
+
+def run_isolated(case, workdir, workers):
+    """Run a case in a fresh process so peak RSS is per case"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run_case, case, workdir, workers).result()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark',
+        description="Benchmark the fill pipeline on synthetic templates and CSV data."
+    )
+    parser.add_argument('--rows', type=int, nargs='+', default=[200])
+    parser.add_argument('--fields', type=int, nargs='+', default=[10, 40])
+    parser.add_argument('--pages', type=int, nargs='+', default=[1])
+    parser.add_argument('--text-length', type=int, nargs='+', default=[12])
+    parser.add_argument('--rtl', action='store_true',
+                        help="also run every case with Hebrew/number values")
+    parser.add_argument('--embedded-font', action='store_true',
+                        help="also run every case with a template embedding a font")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="processes for the parallel mode (default: CPU count)")
+    parser.add_argument('--json', metavar='PATH',
+                        help="also write results as JSON, for comparing runs")
+    parser.add_argument('--keep', metavar='DIR',
+                        help="generate inputs in DIR and keep them between runs")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    workdir = args.keep or tempfile.mkdtemp(prefix='fill_pdf_bench_')
+    os.makedirs(workdir, exist_ok=True)
+
+    cases = [
+        dict(pages=pages, fields=fields, rows=rows, text_length=text_length,
+             rtl=rtl, embedded_font=embedded_font, mode=mode)
+        for pages, fields, rows, text_length, rtl, embedded_font, mode in itertools.product(
+            args.pages, args.fields, args.rows, args.text_length,
+            [False, True] if args.rtl else [False],
+            [False, True] if args.embedded_font else [False],
+            args.modes
+        )
+    ]
+
+    header = f"{'case':<36} {'mode':<9} {'rows/s':>9} {'peak MB':>9} {'bytes/row':>11}"
+    print(header)
+    print("-" * len(header))
+    results = []
+    try:
+        for case in cases:
+            result = run_isolated(case, workdir, args.workers)
+            results.append(result)
+            print(f"{result['name']:<36} {result['mode']:<9} "
+                  f"{result['rows_per_sec']:9.1f} {result['peak_rss_mb']:9.1f} "
+                  f"{result['bytes_per_row']:11.0f}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Detect fillable fields in a template PDF.
+
+Fields come from the template's AcroForm text widgets and, on flat PDFs,
+from blank underlines and empty boxes in the page drawings. Pages are
+scanned in parallel. Run as ``python -m detect`` to write a field
+configuration, or use detect_fields from the editor.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pymupdf as fitz
+
+from batch import save_field_config
+
+logger = logging.getLogger('detect')
+
+# Rules shorter than this (in points) are decoration, not blanks to fill
+MIN_BLANK_WIDTH = 36
+# Boxes between these heights are taken as entry boxes, not frames or tables
+MIN_BOX_HEIGHT = 8
+MAX_BOX_HEIGHT = 36
+# Height of a field placed on a blank underline
+BLANK_HEIGHT = 12
+# Rules thinner than this are lines even when drawn as filled rectangles
+RULE_THICKNESS = 2
+# Fewer pages than this per process are scanned faster than a pool starts
+PAGES_PER_WORKER = 8
+
+
+def field_font_size(height):
+    """Font size the editor gives a field of this height"""
+    return max(1, int(height * 1.1))
+
+
+def widget_fields(page):
+    """Fields of the AcroForm text widgets on a page"""
+    fields = []
+    for widget in page.widgets():
+        if widget.field_type != fitz.PDF_WIDGET_TYPE_TEXT or not widget.field_name:
+            continue
+        rect = widget.rect
+        fields.append({
+            'name': widget.field_name,
+            'x': rect.x0,
+            'y': rect.y0,
+            'width': rect.width,
+            'height': rect.height,
+            # 0 means auto size in the form, use the editor's ratio instead
+            'font_size': int(widget.text_fontsize) or field_font_size(rect.height),
+            # Filled through the widget itself rather than drawn over it
+            'fill': 'widget'
+        })
+    return fields
+
+
+def page_candidates(page):
+    """Blank underlines and empty boxes on a page, as field boxes"""
+    rules = []
+    boxes = []
+    for drawing in page.get_drawings():
+        for item in drawing['items']:
+            if item[0] == 'l':
+                start, end = item[1], item[2]
+                if abs(start.y - end.y) < 1:
+                    rules.append(fitz.Rect(min(start.x, end.x), start.y, max(start.x, end.x), start.y))
+            elif item[0] == 're':
+                rect = fitz.Rect(item[1])
+                if rect.height < RULE_THICKNESS:
+                    rules.append(fitz.Rect(rect.x0, rect.y1, rect.x1, rect.y1))
+                elif MIN_BOX_HEIGHT <= rect.height <= MAX_BOX_HEIGHT:
+                    boxes.append(rect)
+
+    words = [fitz.Rect(word[:4]) for word in page.get_text('words')]
+
+    def is_blank(rect):
+        return not any(rect.intersects(word) for word in words)
+
+    found = []
+    for rect in boxes:
+        if rect.width >= MIN_BLANK_WIDTH and is_blank(rect):
+            found.append(fitz.Rect(rect.x0 + 1, rect.y0 + 1, rect.x1 - 1, rect.y1 - 1))
+    for rule in rules:
+        if rule.width < MIN_BLANK_WIDTH:
+            continue
+        # The space just above the rule, where the value is written
+        rect = fitz.Rect(rule.x0, rule.y0 - BLANK_HEIGHT, rule.x1, rule.y0 - 1)
+        # Bottom edges of boxes drawn as separate lines are not blanks of their own
+        if is_blank(rect) and not any(rect.intersects(other) for other in found):
+            found.append(rect)
+    return sorted(found, key=lambda rect: (round(rect.y0), rect.x0))
+
+
+def detect_page(doc, page_number):
+    """Fields on one page: its widgets, or blanks when it has none"""
+    page = doc[page_number]
+    fields = widget_fields(page)
+    if not fields:
+        for number, rect in enumerate(page_candidates(page), 1):
+            fields.append({
+                'name': f"page{page_number + 1}_field{number}",
+                'x': rect.x0,
+                'y': rect.y0,
+                'width': rect.width,
+                'height': rect.height,
+                'font_size': field_font_size(rect.height)
+            })
+    for field in fields:
+        field['page'] = page_number
+    return fields
+
+
+def _detect_pages(pdf_path, page_numbers):
+    doc = fitz.open(pdf_path)
+    try:
+        return [field for page_number in page_numbers for field in detect_page(doc, page_number)]
+    finally:
+        doc.close()
+
+
+def detect_fields(pdf_path, workers=1):
+    """Detect fields on every page of a template, in page and reading order.
+
+    With more than one worker, longer templates are split over a process
+    pool.
+    Widgets sharing a name (e.g. the same field on several pages) are
+    kept once, since a field name maps to one CSV column.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    workers = max(1, min(workers, -(-page_count // PAGES_PER_WORKER)))
+    if workers == 1:
+        found = _detect_pages(pdf_path, range(page_count))
+    else:
+        size = -(-page_count // workers)
+        chunks = [range(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            found = [
+                field
+                for fields in pool.map(_detect_pages, [pdf_path] * len(chunks), chunks)
+                for field in fields
+            ]
+
+    fields = []
+    names = set()
+    for field in sorted(found, key=lambda field: (field['page'], round(field['y']), field['x'])):
+        if field['name'] in names:
+            continue
+        names.add(field['name'])
+        fields.append(field)
+    logger.info("Detected %d fields on %d pages", len(fields), page_count)
+    return fields
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m detect',
+        description="Detect form widgets and blank lines in a PDF template "
+                    "and write them as a field configuration."
+    )
+    parser.add_argument('pdf', help="template PDF")
+    parser.add_argument('-o', '--output',
+                        help="field configuration JSON to write (default: <pdf>.json)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of processes scanning pages (default: CPU count)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output = args.output or os.path.splitext(args.pdf)[0] + '.json'
+    try:
+        fields = detect_fields(args.pdf, workers=args.workers)
+        save_field_config(output, fields)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{len(fields)} fields have been written to: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
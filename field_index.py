@@ -0,0 +1,164 @@
+"""Spatial index over field boxes, for region queries, hit-testing and snapping."""
+from bisect import bisect_left
+from collections import defaultdict
+
+# Distance in points around a field in which other fields are snap targets
+SNAP_REACH = 300
+
+
+class SnapLines:
+    """Sorted x and y positions of page geometry (text lines, rules, boxes)"""
+    def __init__(self, xs=(), ys=()):
+        self.xs = sorted(set(xs))
+        self.ys = sorted(set(ys))
+
+    @staticmethod
+    def nearest(values, value, tolerance):
+        """Closest of the sorted values within tolerance of value, or None"""
+        i = bisect_left(values, value)
+        best = None
+        for candidate in values[max(0, i - 1):i + 1]:
+            if abs(candidate - value) <= tolerance and (
+                    best is None or abs(candidate - value) < abs(best - value)):
+                best = candidate
+        return best
+
+
+class FieldIndex:
+    """Uniform grid over field boxes, in PDF points, per page.
+
+    Fields are the editor's field dicts; a field is found through every
+    grid cell its box touches, so a region query only looks at the
+    fields near that region instead of scanning all of them.
+    """
+    def __init__(self, cell_size=50):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.boxes = {}
+        self.fields = {}
+
+    @staticmethod
+    def box(field):
+        return (field['x'], field['y'], field['x'] + field['width'], field['y'] + field['height'])
+
+    def cells_for(self, page, box):
+        x0, y0, x1, y1 = box
+        size = self.cell_size
+        for column in range(int(x0 // size), int(x1 // size) + 1):
+            for row in range(int(y0 // size), int(y1 // size) + 1):
+                yield (page, column, row)
+
+    def insert(self, field):
+        key = id(field)
+        box = self.box(field)
+        self.boxes[key] = (field['page'], box)
+        self.fields[key] = field
+        for cell in self.cells_for(field['page'], box):
+            self.cells[cell].add(key)
+
+    def remove(self, field):
+        key = id(field)
+        if key not in self.boxes:
+            return
+        page, box = self.boxes.pop(key)
+        del self.fields[key]
+        for cell in self.cells_for(page, box):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def update(self, field):
+        """Re-index a field after it moved or was resized"""
+        if self.boxes.get(id(field)) != (field['page'], self.box(field)):
+            self.remove(field)
+            self.insert(field)
+
+    def rebuild(self, fields):
+        self.cells.clear()
+        self.boxes.clear()
+        self.fields.clear()
+        for field in fields:
+            self.insert(field)
+
+    def hit(self, page, x, y):
+        """The smallest field on page whose box contains the point, or None"""
+        found = self.query(page, x, y, x, y)
+        if not found:
+            return None
+        return min(found, key=lambda field: field['width'] * field['height'])
+
+    def overlaps(self, field):
+        """Other fields whose boxes overlap this one (touching edges do not count)"""
+        x0, y0, x1, y1 = self.box(field)
+        return [
+            other for other in self.query(field['page'], x0, y0, x1, y1)
+            if other is not field
+            and other['x'] < x1 and other['x'] + other['width'] > x0
+            and other['y'] < y1 and other['y'] + other['height'] > y0
+        ]
+
+    def snap(self, field, x, y, lines, tolerance):
+        """Align a field being moved to x, y with nearby fields and page lines.
+
+        The field's left, center and right edges snap to the same edges of
+        fields within SNAP_REACH and to the vertical page lines; its top and
+        bottom edges likewise. Returns the snapped x, y and the guide
+        positions that were snapped to (None when not snapped).
+        """
+        width, height = field['width'], field['height']
+        neighbours = [
+            other for other in self.query(
+                field['page'], x - SNAP_REACH, y - SNAP_REACH,
+                x + width + SNAP_REACH, y + height + SNAP_REACH
+            )
+            if other is not field
+        ]
+
+        x_targets = []
+        y_targets = []
+        for other in neighbours:
+            x_targets += [other['x'], other['x'] + other['width'] / 2, other['x'] + other['width']]
+            y_targets += [other['y'], other['y'] + other['height']]
+
+        def best(edges, targets, line_values):
+            # edges: (offset from the field origin, edge position)
+            result = None
+            for offset, edge in edges:
+                candidates = [target for target in targets if abs(target - edge) <= tolerance]
+                line = SnapLines.nearest(line_values, edge, tolerance)
+                if line is not None:
+                    candidates.append(line)
+                for target in candidates:
+                    if result is None or abs(target - edge) < abs(result[1] - result[2]):
+                        result = (offset, target, edge)
+            return result
+
+        guide_x = guide_y = None
+        snapped = best(
+            [(0, x), (width / 2, x + width / 2), (width, x + width)],
+            x_targets, lines.xs if lines else []
+        )
+        if snapped:
+            offset, guide_x, _ = snapped
+            x = guide_x - offset
+        snapped = best(
+            [(0, y), (height, y + height)],
+            y_targets, lines.ys if lines else []
+        )
+        if snapped:
+            offset, guide_y, _ = snapped
+            y = guide_y - offset
+        return x, y, guide_x, guide_y
+
+    def query(self, page, x0, y0, x1, y1):
+        """Fields on page whose box intersects the given region"""
+        keys = set()
+        for cell in self.cells_for(page, (x0, y0, x1, y1)):
+            keys.update(self.cells.get(cell, ()))
+
+        found = []
+        for key in keys:
+            bx0, by0, bx1, by1 = self.boxes[key][1]
+            if bx0 <= x1 and bx1 >= x0 and by0 <= y1 and by1 >= y0:
+                found.append(self.fields[key])
+        return found
@@ -0,0 +1,396 @@
+"""Text layout of field values: fitting and bidi reordering, cached per run.
+
+Values are fitted into their field (see FIT_POLICIES) using glyph
+advances measured once per font, then reordered for display. Values
+are stored in logical order, but text is drawn left to right, so
+right-to-left scripts (Hebrew, Arabic) are reordered with the Unicode
+Bidirectional Algorithm (UAX #9). Explicit embedding and isolate
+controls are not supported; every line of a value is one paragraph
+whose direction comes from its first strong character.
+"""
+import math
+import unicodedata
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+
+# Laid out values kept per run; repeated values (e.g. a city name on
+# thousands of rows) are laid out once
+LAYOUT_CACHE_SIZE = 4096
+
+# What to do with values that do not fit their field:
+#   none      draw as is; insert_textbox then draws nothing (the default)
+#   shrink    reduce the font size, down to MIN_FONT_SIZE
+#   wrap      break into lines at word boundaries, cutting off what is left
+#   ellipsis  cut off each line with an ellipsis
+FIT_POLICIES = ('none', 'shrink', 'wrap', 'ellipsis')
+MIN_FONT_SIZE = 4
+
+# Room left when comparing widths, against rounding differences with
+# insert_textbox, which measures lines by subtraction
+EPSILON = 1e-3
+
+# Neutral and weak types after rule W6
+NEUTRALS = {'B', 'S', 'WS', 'ON'}
+
+# Characters shown mirrored inside right-to-left text (rule L4)
+MIRRORS = dict(zip('()[]{}<>«»‹›', ')(][}{><»«›‹'))
+
+
+@lru_cache(maxsize=None)
+def bidi_class(char):
+    # Formatting controls are unsupported and treated as other neutrals
+    kind = unicodedata.bidirectional(char)
+    if kind in ('', 'BN', 'LRE', 'RLE', 'LRO', 'RLO', 'PDF', 'LRI', 'RLI', 'FSI', 'PDI'):
+        return 'ON'
+    return kind
+
+
+def paragraph_level(classes):
+    """0 for left-to-right, 1 for right-to-left, from the first strong character"""
+    for kind in classes:
+        if kind == 'L':
+            return 0
+        if kind in ('R', 'AL'):
+            return 1
+    return 0
+
+
+def resolve_levels(classes, level):
+    """Embedding levels of one line, by the weak, neutral and implicit rules"""
+    types = list(classes)
+    count = len(types)
+    sos = 'R' if level % 2 else 'L'
+    # Rules for types that do not occur are skipped
+    present = set(types)
+
+    # W1: non-spacing marks take the type of the previous character
+    if 'NSM' in present:
+        previous = sos
+        for i, kind in enumerate(types):
+            if kind == 'NSM':
+                types[i] = previous
+            previous = types[i]
+
+    # W2, W3: European numbers after Arabic letters are Arabic numbers
+    if 'AL' in present:
+        strong = sos
+        for i, kind in enumerate(types):
+            if kind in ('L', 'R', 'AL'):
+                strong = kind
+            elif kind == 'EN' and strong == 'AL':
+                types[i] = 'AN'
+        types = ['R' if kind == 'AL' else kind for kind in types]
+
+    # W4: a single separator between two numbers of the same kind
+    if 'ES' in present or 'CS' in present:
+        for i in range(1, count - 1):
+            before, kind, after = types[i - 1], types[i], types[i + 1]
+            if before == after and (
+                    (kind == 'ES' and before == 'EN') or (kind == 'CS' and before in ('EN', 'AN'))):
+                types[i] = before
+
+    # W5: terminators (%, currency signs) next to European numbers
+    i = 0 if 'ET' in present else count
+    while i < count:
+        if types[i] != 'ET':
+            i += 1
+            continue
+        end = i
+        while end < count and types[end] == 'ET':
+            end += 1
+        if (i > 0 and types[i - 1] == 'EN') or (end < count and types[end] == 'EN'):
+            types[i:end] = ['EN'] * (end - i)
+        i = end
+
+    # W6: remaining separators and terminators are neutral
+    types = ['ON' if kind in ('ES', 'ET', 'CS') else kind for kind in types]
+
+    # W7: European numbers in left-to-right context are left-to-right
+    if 'EN' in present:
+        strong = sos
+        for i, kind in enumerate(types):
+            if kind in ('L', 'R'):
+                strong = kind
+            elif kind == 'EN' and strong == 'L':
+                types[i] = 'L'
+
+    # N1, N2: neutrals between characters of one direction take it,
+    # others take the embedding direction; numbers count as right-to-left
+    def direction(kind):
+        return 'L' if kind == 'L' else 'R'
+
+    i = 0
+    while i < count:
+        if types[i] not in NEUTRALS:
+            i += 1
+            continue
+        end = i
+        while end < count and types[end] in NEUTRALS:
+            end += 1
+        before = direction(types[i - 1]) if i > 0 else sos
+        after = direction(types[end]) if end < count else sos
+        types[i:end] = [before if before == after else sos] * (end - i)
+        i = end
+
+    # I1, I2: implicit levels
+    levels = []
+    for kind in types:
+        if level % 2 == 0:
+            levels.append(level + {'L': 0, 'R': 1}.get(kind, 2))
+        else:
+            levels.append(level + (0 if kind == 'R' else 1))
+
+    # L1: trailing whitespace goes back to the paragraph level
+    for i in range(count - 1, -1, -1):
+        if classes[i] not in ('WS', 'S', 'B'):
+            break
+        levels[i] = level
+    return levels
+
+
+def visual_line(line):
+    """One line of text reordered from logical to display order"""
+    classes = [bidi_class(char) for char in line]
+    level = paragraph_level(classes)
+    levels = resolve_levels(classes, level)
+
+    # L3: combining marks stay with their base character when reversed
+    chars = []
+    cluster_levels = []
+    for char, kind, char_level in zip(line, classes, levels):
+        if kind == 'NSM' and chars:
+            chars[-1] += char
+            continue
+        chars.append(MIRRORS.get(char, char) if char_level % 2 else char)
+        cluster_levels.append(char_level)
+    levels = cluster_levels
+
+    # L2: reverse runs at each level, from the highest to the lowest odd one
+    highest = max(levels, default=0)
+    lowest_odd = min((char_level for char_level in levels if char_level % 2), default=highest + 1)
+    for current in range(highest, lowest_odd - 1, -1):
+        i = 0
+        while i < len(chars):
+            if levels[i] < current:
+                i += 1
+                continue
+            end = i
+            while end < len(chars) and levels[end] >= current:
+                end += 1
+            chars[i:end] = chars[i:end][::-1]
+            levels[i:end] = levels[i:end][::-1]
+            i = end
+    return ''.join(chars)
+
+
+def visual_order(text):
+    """Text reordered for drawing left to right, line by line"""
+    if text.isascii():
+        return text  # No right-to-left characters, nothing to reorder
+    return '\n'.join(visual_line(line) for line in text.split('\n'))
+
+
+class FontMetrics:
+    """Glyph advances of a font at size 1, cached in an array by code point.
+
+    Text is measured the way insert_textbox measures it, so a value can
+    be fitted arithmetically instead of by trial insertions. Simple
+    (base-14) fonts draw characters above 255 as '?'.
+    """
+    PLANE = 0x10000
+
+    def __init__(self, font, simple=False):
+        self.font = font
+        self.simple = simple
+        self.advances = array('d', [-1.0]) * self.PLANE
+        self.coverage = {}
+        self.descender = font.descender
+        spread = font.ascender - font.descender
+        self.line_factor = spread if spread > 1 else 1.2
+        self.ellipsis = '...' if simple else '…'
+
+    def advance(self, char):
+        code = ord(char)
+        if self.simple and code > 255:
+            code = ord('?')
+        if code >= self.PLANE:
+            return self.measure(code)
+        width = self.advances[code]
+        if width < 0:
+            width = self.advances[code] = self.measure(code)
+        return width
+
+    def measure(self, code):
+        # insert_textbox gives characters without a glyph no width
+        if not self.simple and not self.covers(chr(code)):
+            return 0.0
+        return self.font.glyph_advance(code)
+
+    def width(self, text):
+        return sum(map(self.advance, text))
+
+    def covers(self, char):
+        """Whether the font has a glyph for char"""
+        code = ord(char)
+        if self.simple and code > 255:
+            return False
+        covered = self.coverage.get(code)
+        if covered is None:
+            covered = self.coverage[code] = bool(self.font.has_glyph(code))
+        return covered
+
+    def missing(self, text):
+        """Characters of text the font has no glyph for, other than line breaks"""
+        return {char for char in set(text) if char not in '\r\n' and not self.covers(char)}
+
+    def line_capacity(self, font_size, height):
+        """Number of lines insert_textbox fits into height"""
+        return max(0, math.floor((height / font_size + self.descender) / self.line_factor + EPSILON))
+
+    def wrap(self, text, font_size, width):
+        """Break text into lines no wider than width, like insert_textbox does"""
+        room = width / font_size - EPSILON
+        space = self.advance(' ')
+        lines = []
+        for paragraph in text.split('\n'):
+            line = []
+            rest = room
+            for word in paragraph.split(' '):
+                word_width = self.width(word)
+                if word_width <= rest:
+                    line.append(word)
+                    rest -= word_width + space
+                    continue
+                if line:
+                    lines.append(' '.join(line))
+                if word_width <= room:
+                    line = [word]
+                    rest = room - word_width - space
+                    continue
+
+                # A word longer than a line is broken between characters
+                part = ''
+                part_width = 0
+                for char in word:
+                    char_width = self.advance(char)
+                    if part and part_width + char_width > room:
+                        lines.append(part)
+                        part, part_width = '', 0
+                    part += char
+                    part_width += char_width
+                line = [part]
+                rest = room - part_width - space
+            lines.append(' '.join(line))
+        return lines
+
+    def truncate(self, line, font_size, width, force=False):
+        """Cut line off with an ellipsis where it would overflow width.
+
+        With force set the ellipsis is added even if the line fits, to
+        mark that lines after it were cut off.
+        """
+        room = width / font_size - EPSILON
+        if not force and self.width(line) <= room:
+            return line
+        room -= self.width(self.ellipsis)
+        used = 0
+        for end, char in enumerate(line):
+            used += self.advance(char)
+            if used > room:
+                line = line[:end]
+                break
+        return line.rstrip() + self.ellipsis
+
+
+class LayoutCache:
+    """Bounded LRU of laid out values, shared by the fields of a run"""
+    def __init__(self, size=LAYOUT_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[key] = compute()
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+
+class FieldLayout:
+    """Layout parameters of one field, computed once per run.
+
+    Fields with the same font, size, box and fit policy share cache
+    entries, so a value is laid out once for all of them.
+    """
+    def __init__(self, rect, font_size, fontname, metrics, fit, cache):
+        if fit not in FIT_POLICIES:
+            raise ValueError(f"Unknown fit policy '{fit}', expected one of {', '.join(FIT_POLICIES)}")
+        self.rect = rect
+        self.font_size = font_size
+        self.fontname = fontname
+        self.metrics = metrics
+        self.fit_policy = fit
+        self.cache = cache
+        self.key = (fontname, font_size, rect.width, rect.height, fit)
+
+    def fit(self, value):
+        """The value as it is drawn into the field: (text, font size, overflowed).
+
+        Without a fit policy overflow is only known once insert_textbox
+        refuses the text, so it is reported as False here.
+        """
+        if self.fit_policy == 'none':
+            if value.isascii():
+                return value, self.font_size, False
+            return self.cache.get((self.key, value), lambda: (visual_order(value), self.font_size, False))
+        return self.cache.get((self.key, value), lambda: self.layout(value))
+
+    def overflows(self, value):
+        """Whether value does not fit the field, even after applying the fit policy"""
+        if self.fit_policy != 'none':
+            return self.fit(value)[2]
+        # insert_textbox breaks the text as drawn, in display order
+        metrics = self.metrics
+        lines = metrics.wrap(self.fit(value)[0], self.font_size, self.rect.width)
+        return len(lines) > metrics.line_capacity(self.font_size, self.rect.height)
+
+    def layout(self, value):
+        metrics = self.metrics
+        width, height = self.rect.width, self.rect.height
+        font_size = self.font_size
+        lines = value.split('\n')
+        overflowed = False
+
+        if self.fit_policy == 'shrink':
+            widest = max(map(metrics.width, lines))
+            size = min(
+                font_size,
+                (width - EPSILON) / widest if widest else font_size,
+                height / (metrics.line_factor * len(lines) - metrics.descender)
+            )
+            size = math.floor(size * 10) / 10
+            if size >= MIN_FONT_SIZE:
+                return visual_order(value), size, False
+            # Still too long at the smallest size, cut it off there
+            font_size = MIN_FONT_SIZE
+            overflowed = True
+        elif self.fit_policy == 'wrap':
+            lines = metrics.wrap(value, font_size, width)
+
+        capacity = metrics.line_capacity(font_size, height)
+        fitted = [metrics.truncate(line, font_size, width) for line in lines[:capacity]]
+        if len(lines) > capacity:
+            if fitted:
+                fitted[-1] = metrics.truncate(fitted[-1], font_size, width, force=True)
+            overflowed = True
+        overflowed = overflowed or fitted != lines[:capacity]
+        return visual_order('\n'.join(fitted)), font_size, overflowed
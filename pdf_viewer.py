@@ -1,22 +1,213 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import fitz
-import json
-import csv
+import pymupdf as fitz
+import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from PIL import Image, ImageTk
-from datetime import datetime
+from batch import (
+    BatchProcessor, count_csv_rows, default_output_dir, load_field_config,
+    portable_fields, save_field_config
+)
+from detect import detect_fields
+from field_index import FieldIndex, SnapLines
+
+logger = logging.getLogger(__name__)
+
+# Canvas pixels per PDF point at 100% zoom; field coordinates are in points
+BASE_SCALE = 2
+ZOOM_LEVELS = (0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0)
+
+# Pixels per PDF point of the quick preview shown before the full render
+PREVIEW_SCALE = 0.5
+
+# Pages larger than this are rendered in tiles covering only the visible region
+TILED_PIXELS = 4096 * 4096
+TILE_SIZE = 1024
+
+# Rendered images kept in memory, least recently used are dropped first
+CACHE_PIXELS = 64 * 1024 * 1024
+
+# Field redraws from drag, resize and scroll events are batched per frame
+FRAME_MS = 16
+
+# Screen distance within which a dragged field snaps to alignment guides
+SNAP_PIXELS = 6
+
+# Optional field settings kept as they are through load and save
+FIELD_OPTIONS = ('fill', 'widget', 'font', 'fit')
+
+# PyMuPDF is not thread safe and the renderer thread is using it, so other
+# PyMuPDF work runs in processes started fresh rather than forked from Tk
+PROCESS_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def _detect_process(pdf_path, workers, results):
+    """Detect fields in a process of its own, which may start a pool in turn"""
+    try:
+        results.put(('detected', detect_fields(pdf_path, workers=workers)))
+    except Exception as e:
+        results.put(('error', str(e)))
+
+
+def _batch_process(pdf_path, field_config, csv_path, output_dir, results, cancel):
+    """Run a batch in a process of its own, posting its total, progress and outcome"""
+    # Counting reads the whole file, so it runs alongside the rendering
+    threading.Thread(
+        target=lambda: results.put(('total', count_csv_rows(csv_path))), daemon=True
+    ).start()
+    try:
+        # A bad row is left out and listed rather than stopping the whole run
+        processor = BatchProcessor(pdf_path, field_config, keep_going=True)
+        count = processor.process_pdfs(
+            csv_path,
+            output_dir,
+            progress=lambda done: results.put(('progress', done)),
+            cancel=cancel
+        )
+        overflows = processor.overflows
+        failures = processor.failures
+        results.put(('finished', {
+            'count': count,
+            'overflows': len(overflows),
+            'first_overflow': min(overflows, default=None),
+            'failures': len(failures),
+            'failed_rows': [failure['row'] for failure in failures[:10]],
+            'errors_path': processor.dead_letter_path
+        }))
+    except Exception as e:
+        results.put(('error', str(e)))
+
+
+def page_geometry(page):
+    """Edges of text lines, rules and boxes on a page, for snapping fields"""
+    xs, ys = [], []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            x0, y0, x1, y1 = line["bbox"]
+            xs += [x0, x1]
+            ys += [y0, y1]
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == 'l':
+                start, end = item[1], item[2]
+                if abs(start.y - end.y) < 1:  # Horizontal rule, e.g. a blank to fill
+                    ys.append(start.y)
+                    xs += [min(start.x, end.x), max(start.x, end.x)]
+                elif abs(start.x - end.x) < 1:
+                    xs.append(start.x)
+            elif item[0] == 're':
+                rect = item[1]
+                xs += [rect.x0, rect.x1]
+                ys += [rect.y0, rect.y1]
+    return xs, ys
+
+class PageRenderer:
+    """Opens the PDF and rasterizes pages on a background thread.
+    
+    The editor's PyMuPDF calls all happen on this thread. Finished images
+    are put on a queue that the Tk thread polls; requests made for an
+    older render token than the latest one are skipped.
+    """
+    def __init__(self, pdf_path):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.latest_token = 0
+        self.thread = threading.Thread(target=self.run, args=(pdf_path,), daemon=True)
+        self.thread.start()
+    
+    def request(self, token, key, page_number, scale, clip=None, size=None):
+        """Queue a render of a page, or the clip region of it, at scale"""
+        self.requests.put(('render', token, key, page_number, scale, clip, size))
+    
+    def request_geometry(self, page_number):
+        """Queue extraction of a page's text and line geometry"""
+        self.requests.put(('geometry', page_number))
+    
+    def cancel_before(self, token):
+        """Drop queued requests made for earlier tokens"""
+        self.latest_token = token
+    
+    def close(self):
+        self.requests.put(None)
+    
+    def run(self, pdf_path):
+        try:
+            doc = fitz.open(pdf_path)
+            page_rects = [tuple(page.rect) for page in doc]
+        except Exception as e:
+            self.results.put(('error', None, str(e)))
+            return
+        self.results.put(('opened', None, page_rects))
+        
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            
+            if request[0] == 'geometry':
+                page_number = request[1]
+                try:
+                    geometry = page_geometry(doc[page_number])
+                except Exception:
+                    logger.exception("Failed to read geometry of page %d", page_number + 1)
+                    geometry = ([], [])
+                self.results.put(('geometry', page_number, geometry))
+                continue
+            
+            _, token, key, page_number, scale, clip, size = request
+            if token < self.latest_token:
+                continue
+            
+            try:
+                pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip)
+                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                if size:
+                    img = img.resize(size, Image.BILINEAR)
+            except Exception:
+                logger.exception("Failed to render page %d", page_number + 1)
+                continue
+            self.results.put(('image', (token, key), img))
+        doc.close()
 
 class PDFViewer:
     def __init__(self, parent, pdf_path):
         self.parent = parent
         self.pdf_path = pdf_path
+        self.current_page = 0
+        self.zoom = 1.0
+        self.page_cache = OrderedDict()
+        self.cache_pixels = 0
+        self.page_image = None
+        self.page_rects = []
+        self.shown_key = None
+        self.tiled = False
+        self.tile_items = {}
+        self.visible_tiles = set()
+        self.requested_tiles = set()
+        self.render_token = 0
+        self.window_sized = False
         self.is_adding_field = False
         self.is_naming_field = False
         self.form_fields = []
+        self.field_index = FieldIndex()
+        self.dirty_fields = {}
+        self.placed_entries = {}
+        self.placed_scroll = None
+        self.viewport_dirty = False
+        self.redraw_job = None
+        self.page_lines = {}
+        self.snap_guides = (None, None)
+        self.guide_items = []
         self.selected_field = None
         self.resize_mode = None
         self.has_unsaved_changes = False
+        self.batch_process = None
+        self.detected_fields = []
         
         # Create main frame with no padding
         self.main_frame = ttk.Frame(parent)
@@ -55,6 +246,15 @@ class PDFViewer:
         )
         self.load_btn.pack(side=tk.LEFT, padx=5)
         
+        self.detect_btn = ttk.Button(
+            self.button_frame,
+            text="Detect Fields",
+            command=self.add_detected_fields,
+            style='Welcome.TButton',
+            state='disabled'
+        )
+        self.detect_btn.pack(side=tk.LEFT, padx=5)
+        
         self.process_btn = ttk.Button(
             self.button_frame, 
             text="Process with CSV", 
@@ -64,6 +264,60 @@ class PDFViewer:
         )
         self.process_btn.pack(side=tk.LEFT, padx=5)
         
+        # Page navigation
+        self.page_frame = ttk.Frame(self.toolbar)
+        self.page_frame.pack(side=tk.LEFT, padx=(15, 0))
+        
+        self.prev_page_btn = ttk.Button(
+            self.page_frame,
+            text="◀",
+            width=3,
+            command=lambda: self.show_page(self.current_page - 1)
+        )
+        self.prev_page_btn.pack(side=tk.LEFT)
+        
+        self.page_var = tk.StringVar()
+        ttk.Label(
+            self.page_frame,
+            textvariable=self.page_var,
+            font=('Segoe UI', 11),
+            padding=(8, 0)
+        ).pack(side=tk.LEFT)
+        
+        self.next_page_btn = ttk.Button(
+            self.page_frame,
+            text="▶",
+            width=3,
+            command=lambda: self.show_page(self.current_page + 1)
+        )
+        self.next_page_btn.pack(side=tk.LEFT)
+        
+        # Zoom
+        self.zoom_out_btn = ttk.Button(
+            self.page_frame,
+            text="−",
+            width=3,
+            command=lambda: self.step_zoom(-1)
+        )
+        self.zoom_out_btn.pack(side=tk.LEFT, padx=(15, 0))
+        
+        self.zoom_var = tk.StringVar()
+        ttk.Label(
+            self.page_frame,
+            textvariable=self.zoom_var,
+            font=('Segoe UI', 11),
+            width=5,
+            anchor='center'
+        ).pack(side=tk.LEFT)
+        
+        self.zoom_in_btn = ttk.Button(
+            self.page_frame,
+            text="+",
+            width=3,
+            command=lambda: self.step_zoom(1)
+        )
+        self.zoom_in_btn.pack(side=tk.LEFT)
+        
         # Add separator between buttons and status
         ttk.Separator(self.toolbar, orient='vertical').pack(side=tk.LEFT, fill=tk.Y, padx=15, pady=5)
         
@@ -79,6 +333,22 @@ class PDFViewer:
         )
         self.status_label.pack(side=tk.LEFT, fill=tk.Y)
         
+        # Batch progress, only shown while processing
+        self.progress_frame = ttk.Frame(self.toolbar)
+        self.progress_bar = ttk.Progressbar(
+            self.progress_frame,
+            orient=tk.HORIZONTAL,
+            length=200,
+            mode='determinate'
+        )
+        self.progress_bar.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = ttk.Button(
+            self.progress_frame,
+            text="Cancel",
+            command=self.cancel_batch
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
         # Create canvas frame with no extra padding
         self.canvas_frame = ttk.Frame(self.main_frame)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True)
@@ -118,6 +388,8 @@ class PDFViewer:
         # Bind mouse wheel
         self.canvas.bind('<MouseWheel>', self.on_mousewheel)
         self.canvas.bind('<Shift-MouseWheel>', self.on_shift_mousewheel)
+        self.canvas.bind('<Control-MouseWheel>', 
+            lambda e: self.step_zoom(1 if e.delta > 0 else -1))
         
         # Grid layout
         self.canvas.grid(row=0, column=0, sticky="nsew")
@@ -127,9 +399,19 @@ class PDFViewer:
         # Bind events
         self.canvas.bind("<Button-1>", self.on_canvas_click)
         
-        # Load PDF
-        self.doc = fitz.open(pdf_path)
-        self.display_page()
+        # Load PDF in the background, showing a placeholder meanwhile
+        self.placeholder = self.canvas.create_text(
+            20, 20,
+            text=f"Loading {os.path.basename(pdf_path)}...",
+            anchor='nw',
+            font=('Segoe UI', 12),
+            fill='#6c757d'
+        )
+        self.renderer = PageRenderer(pdf_path)
+        self.main_frame.bind('<Destroy>', lambda e: self.renderer.close(), add='+')
+        self.update_page_controls()
+        self.parent.after(20, self.poll_renderer)
+        self.start_detection()
         
         # Bind scroll events
         self.canvas.bind('<Configure>', self.on_canvas_scroll)
@@ -150,9 +432,7 @@ class PDFViewer:
     
     def save_fields(self):
         try:
-            print("\nSaving fields:")
-            print(f"PDF dimensions: {self.doc[0].rect.width} x {self.doc[0].rect.height}")
-            print("-" * 80)
+            logger.debug("Saving fields, %d pages", len(self.page_rects))
             
             json_path = filedialog.asksaveasfilename(
                 defaultextension='.json',
@@ -165,25 +445,29 @@ class PDFViewer:
             
             fields = []
             for field in self.form_fields:
-                # Get coordinates of the rectangle (box)
-                box_coords = self.canvas.coords(field['rect'])
-                box_x = box_coords[0]
-                box_y = box_coords[1]
+                # Coordinates of the rectangle (box), kept in sync while dragging
+                box_x = field['x']
+                box_y = field['y']
                 
-                print(f"Field '{field['name']}': "
-                      f"Box coordinates ({box_x}, {box_y})")
+                logger.debug("Field '%s': Box coordinates (%s, %s) on page %d",
+                             field['name'], box_x, box_y, field['page'] + 1)
                 
-                fields.append({
+                entry = {
                     'name': field['name'],
+                    'page': field['page'],
                     'x': box_x,
                     'y': box_y,
                     'width': field['width'],
                     'height': field['height'],
                     'font_size': field['font_size']
-                })
+                }
+                # How the field is filled and its font, when configured
+                for key in FIELD_OPTIONS:
+                    if key in field:
+                        entry[key] = field[key]
+                fields.append(entry)
             
-            with open(json_path, 'w') as f:
-                json.dump(fields, f, indent=4)
+            save_field_config(json_path, fields)
             
             self.status_var.set(f"✅ Saved {len(fields)} fields to {os.path.basename(json_path)}")
             
@@ -205,128 +489,460 @@ class PDFViewer:
             return
         
         # Create output directory
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = f"{os.path.splitext(csv_path)[0]}_output_{timestamp}"
+        output_dir = default_output_dir(csv_path)
         
         try:
-            # Use current form_fields
-            self.field_config = self.form_fields
+            # Use a snapshot of current form_fields, so editing can continue
+            self.field_config = portable_fields(self.form_fields)
             self.process_pdfs(csv_path, output_dir)
         except Exception as e:
-            error_message = str(e)
-            messagebox.showerror("Error", 
-                f"An error occurred:\n\n{error_message}\n\n"
-                "Click OK to copy the error message.",
-                parent=self.parent
-            )
-            self.parent.clipboard_clear()
-            self.parent.clipboard_append(error_message)
+            self.show_error(str(e))
+    
+    def show_error(self, error_message):
+        """Show an error and copy it to the clipboard"""
+        messagebox.showerror("Error", 
+            f"An error occurred:\n\n{error_message}\n\n"
+            "Click OK to copy the error message.",
+            parent=self.parent
+        )
+        self.parent.clipboard_clear()
+        self.parent.clipboard_append(error_message)
     
     def process_pdfs(self, csv_path, output_dir):
-        """Create PDFs from CSV data"""
-        # Validate CSV headers
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            csv_fields = set(reader.fieldnames)
-            expected_fields = {field['name'] for field in self.field_config}
-            
-            if not expected_fields == csv_fields:
-                missing = expected_fields - csv_fields
-                extra = csv_fields - expected_fields
-                raise ValueError(
-                    f"CSV fields don't match form fields.\n"
-                    f"Missing fields: {missing}\n"
-                    f"Extra fields: {extra}"
-                )
+        """Create PDFs from CSV data in a background process"""
+        self.batch_queue = PROCESS_CONTEXT.Queue()
+        self.batch_cancel = PROCESS_CONTEXT.Event()
+        self.batch_process = PROCESS_CONTEXT.Process(
+            target=_batch_process,
+            args=(self.pdf_path, self.field_config, csv_path, output_dir,
+                  self.batch_queue, self.batch_cancel)
+        )
         
-        # Create output directory
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Process each row
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader, 1):
-                output_path = os.path.join(output_dir, f"output_{i}.pdf")
-                self.create_filled_pdf(row, output_path)
-        
-        messagebox.showinfo("Success", 
-            f"PDFs have been created in:\n{output_dir}")
-    
-    def create_filled_pdf(self, data, output_path):
-        """Create a single filled PDF"""
-        doc = fitz.open(self.pdf_path)
-        page = doc[0]
-        
-        print("\nRendering PDF:")
-        print(f"PDF dimensions: {doc[0].rect.width} x {doc[0].rect.height}")
-        print("-" * 80)
-        
-        for field in self.field_config:
-            text = data[field['name']]
-            
-            # Scale coordinates
-            render_x = field['x'] / 2
-            render_y = field['y'] / 2
-            
-            # Calculate baseline position (about 80% down from the top of the field)
-            baseline_offset = (field['height'] / 2) * 0.8
-            render_y += baseline_offset
-            
-            print(f"Field '{field['name']}': "
-                  f"Original({field['x']}, {field['y']}) -> "
-                  f"Rendered({render_x}, {render_y})")
-            
-            # Create rectangle for text alignment
-            rect = fitz.Rect(
-                render_x, 
-                render_y - (field['height'] / 2),  # Adjust y to account for full height
-                render_x + (field['width'] / 2), 
-                render_y + (field['height'] / 2)
-            )
+        self.batch_output_dir = output_dir
+        self.batch_total = None  # Until the process has counted the rows
+        self.batch_done = 0
+        self.batch_start = time.monotonic()
+        self.progress_bar.configure(mode='indeterminate', value=0)
+        self.progress_bar.start()
+        self.cancel_btn.configure(state='normal')
+        self.progress_frame.pack(side=tk.LEFT, padx=10)
+        self.status_var.set("⏳ Processing rows...")
+        
+        self.batch_process.start()
+        self.update_buttons_state()
+        self.parent.after(100, self.poll_batch)
+    
+    def poll_batch(self):
+        """Apply progress reported by the batch process"""
+        result = None
+        progressed = False
+        try:
+            while True:
+                kind, value = self.batch_queue.get_nowait()
+                if kind == 'progress':
+                    self.batch_done = value
+                    progressed = True
+                elif kind == 'total':
+                    self.batch_total = value
+                    progressed = True
+                else:
+                    result = (kind, value)
+        except queue.Empty:
+            pass
+        
+        if progressed:
+            self.show_batch_progress()
+        
+        if result is None:
+            if self.batch_process.is_alive() or not self.batch_queue.empty():
+                self.parent.after(100, self.poll_batch)
+                return
+            result = ('error', f"The batch process ended unexpectedly "
+                               f"(exit code {self.batch_process.exitcode})")
+        
+        self.batch_process.join()
+        self.batch_process = None
+        self.progress_bar.stop()
+        self.progress_frame.pack_forget()
+        self.update_buttons_state()
+        
+        kind, value = result
+        if kind == 'error':
+            self.status_var.set("❌ Processing failed")
+            self.show_error(value)
+            return
+        
+        count = value['count']
+        if self.batch_cancel.is_set():
+            self.status_var.set(f"⛔ Cancelled after {count} rows")
+            messagebox.showinfo("Cancelled", 
+                f"{count} PDFs were created before cancelling in:\n{self.batch_output_dir}")
+            return
+        
+        message = f"PDFs have been created in:\n{self.batch_output_dir}"
+        if value['overflows']:
+            message += (f"\n\n⚠️ {value['overflows']} rows have values that did not fit "
+                        f"their field (first: row {value['first_overflow']})")
+        failures = value['failures']
+        if failures:
+            self.status_var.set(f"⚠️ Created {count} PDFs, {failures} rows failed")
+            rows = ', '.join(map(str, value['failed_rows']))
+            more = ', ...' if failures > len(value['failed_rows']) else ''
+            message += (f"\n\n❌ {failures} rows failed and were left out "
+                        f"(rows {rows}{more}), details are in:\n{value['errors_path']}")
+            messagebox.showwarning("Partly Done", message)
+        else:
+            self.status_var.set(f"✅ Created {count} PDFs")
+            messagebox.showinfo("Success", message)
+    
+    def show_batch_progress(self):
+        """Show rows done, throughput and, once the rows are counted, time left"""
+        done = self.batch_done
+        elapsed = time.monotonic() - self.batch_start
+        rate = done / elapsed if elapsed > 0 else 0
+        if self.batch_total is None:
+            self.status_var.set(f"⏳ {done} rows · {rate:.1f} rows/s")
+            return
+        
+        total = max(self.batch_total, done)
+        eta = int((total - done) / rate) if rate else 0
+        if str(self.progress_bar.cget('mode')) != 'determinate':
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode='determinate')
+        self.progress_bar.configure(maximum=max(1, total), value=done)
+        self.status_var.set(
+            f"⏳ {done}/{total} rows · {rate:.1f} rows/s · "
+            f"ETA {eta // 60}:{eta % 60:02d}"
+        )
+    
+    def cancel_batch(self):
+        """Stop the batch run after the current row"""
+        self.batch_cancel.set()
+        self.cancel_btn.configure(state='disabled')
+        self.status_var.set("⛔ Cancelling after the current row...")
+    
+    def start_detection(self):
+        """Look for form widgets and blank lines on all pages in a background process"""
+        self.detect_queue = PROCESS_CONTEXT.Queue()
+        self.detect_process = PROCESS_CONTEXT.Process(
+            target=_detect_process,
+            args=(self.pdf_path, os.cpu_count() or 1, self.detect_queue)
+        )
+        self.detect_process.start()
+        self.parent.after(100, self.poll_detection)
+    
+    def poll_detection(self):
+        """Offer the detected fields once detection has finished"""
+        try:
+            kind, value = self.detect_queue.get_nowait()
+        except queue.Empty:
+            if not self.detect_process.is_alive() and self.detect_queue.empty():
+                logger.warning("Field detection ended with exit code %s", self.detect_process.exitcode)
+                return
+            if self.main_frame.winfo_exists():
+                self.parent.after(100, self.poll_detection)
+            return
+        self.detect_process.join()
+        
+        if kind == 'error':
+            logger.warning("Field detection failed: %s", value)
+            return
+        
+        self.detected_fields = value
+        self.update_buttons_state()
+        if value and not self.form_fields and not self.is_adding_field:
+            self.status_var.set(f"🔎 Found {len(value)} fields, click Detect Fields to add them")
+    
+    def add_detected_fields(self):
+        """Add all detected fields at once, skipping ones that clash with existing fields"""
+        names = {field['name'] for field in self.form_fields}
+        added = []
+        skipped = 0
+        for detected in self.detected_fields:
+            field = dict(detected)
+            if field['name'] in names or self.field_index.overlaps(field):
+                skipped += 1
+                continue
+            names.add(field['name'])
+            self.form_fields.append(field)
+            self.field_index.insert(field)
+            added.append(field)
+        self.detected_fields = []
+        
+        # Canvas items for the current page only; their redraw is one coalesced refresh
+        for field in added:
+            if field['page'] == self.current_page:
+                self.draw_field(field)
+        self.mark_overlaps()
+        
+        message = f"✅ Added {len(added)} detected fields"
+        if skipped:
+            message += f" ({skipped} skipped, already placed)"
+        self.status_var.set(message)
+        if added:
+            self.has_unsaved_changes = True
+        self.update_buttons_state()
+    
+    def to_canvas(self, value):
+        """Convert PDF points to canvas pixels at the current zoom"""
+        return value * BASE_SCALE * self.zoom
+    
+    def from_canvas(self, value):
+        """Convert canvas pixels at the current zoom to PDF points"""
+        return value / (BASE_SCALE * self.zoom)
+    
+    def entry_font(self, field):
+        return ('Segoe UI', max(1, round(field['font_size'] * self.zoom)))
+    
+    def cached_image(self, key):
+        """Return a rendered image from the cache, or None"""
+        photo = self.page_cache.get(key)
+        if photo is not None:
+            self.page_cache.move_to_end(key)
+        return photo
+    
+    def store_image(self, key, photo):
+        """Cache a rendered image, dropping the least recently used ones"""
+        self.page_cache[key] = photo
+        self.cache_pixels += photo.width() * photo.height()
+        while self.cache_pixels > CACHE_PIXELS and len(self.page_cache) > 1:
+            _, old = self.page_cache.popitem(last=False)
+            self.cache_pixels -= old.width() * old.height()
+    
+    def poll_renderer(self):
+        """Apply results from the background renderer on the Tk thread"""
+        try:
+            while True:
+                kind, tag, value = self.renderer.results.get_nowait()
+                if kind == 'opened':
+                    self.page_rects = [fitz.Rect(rect) for rect in value]
+                    self.display_page()
+                elif kind == 'geometry':
+                    self.page_lines[tag] = SnapLines(*value)
+                elif kind == 'error':
+                    self.canvas.itemconfigure(self.placeholder, text="❌ Could not open PDF")
+                    self.status_var.set("❌ Failed to open PDF")
+                    messagebox.showerror("Error", f"Failed to open PDF:\n{value}")
+                else:
+                    token, key = tag
+                    photo = ImageTk.PhotoImage(value)
+                    self.store_image(key, photo)
+                    if token == self.render_token:
+                        self.show_rendered(key, photo)
+        except queue.Empty:
+            pass
+        
+        if self.main_frame.winfo_exists():
+            self.parent.after(20, self.poll_renderer)
+    
+    def show_rendered(self, key, photo):
+        """Show an image that just arrived for the current page and zoom"""
+        if len(key) == 4:
+            # Tile, unless it has been scrolled out of view meanwhile
+            if key in self.visible_tiles and key not in self.tile_items:
+                self.add_tile(key, photo)
+        elif key == (self.current_page, self.zoom):
+            self.show_page_image(photo, key)
+        elif self.shown_key != (self.current_page, self.zoom):
+            # Preview, unless the full render won the race
+            self.show_page_image(photo, key)
+    
+    def page_pixel_size(self):
+        """Size of the current page in canvas pixels at the current zoom"""
+        scale = BASE_SCALE * self.zoom
+        irect = (self.page_rects[self.current_page] * fitz.Matrix(scale, scale)).irect
+        return irect.width, irect.height
+    
+    def display_page(self):
+        """Display the current page of PDF at the current zoom"""
+        # Invalidate renders requested for the previous page or zoom
+        self.render_token += 1
+        self.renderer.cancel_before(self.render_token)
+        for item in self.tile_items.values():
+            self.canvas.delete(item)
+        self.tile_items = {}
+        self.visible_tiles = set()
+        self.requested_tiles = set()
+        
+        width, height = self.page_pixel_size()
+        
+        if not self.window_sized:
+            # Calculate desired window size (80% of screen or PDF size, whichever is smaller)
+            screen_width = self.parent.winfo_screenwidth()
+            screen_height = self.parent.winfo_screenheight()
             
+            window_width = min(int(screen_width * 0.8), width + 50)  # Add margin for scrollbars
+            window_height = min(int(screen_height * 0.8), height + 100)  # Add margin for toolbar
             
-            # Reverse Hebrew text before rendering
-            text = text[::-1] if any('\u0590' <= c <= '\u05FF' for c in text) else text
+            # Center the window
+            x = (screen_width - window_width) // 2
+            y = (screen_height - window_height) // 2
             
-            page.insert_textbox(
-                rect,
-                text,
-                fontsize=field['font_size'],
-                color=(0, 0, 0),
-                align=1,  # 1 = center alignment
-                fontname="figo"
-            )
+            # Set window size and position
+            self.parent.geometry(f"{window_width}x{window_height}+{x}+{y}")
+            self.window_sized = True
         
-        doc.save(output_path)
-        doc.close()
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+        self.canvas.itemconfigure(self.placeholder, text="Rendering page...")
+        
+        if self.current_page not in self.page_lines:
+            # Extracted once per page, used for snapping while dragging
+            self.page_lines[self.current_page] = None
+            self.renderer.request_geometry(self.current_page)
+        
+        self.tiled = width * height > TILED_PIXELS
+        if self.tiled:
+            # Only the visible tiles are rendered, see update_tiles
+            self.show_page_image(None)
+            self.parent.after_idle(self.update_tiles)
+        else:
+            key = (self.current_page, self.zoom)
+            preview_key = key + ('preview',)
+            scale = BASE_SCALE * self.zoom
+            if self.cached_image(key):
+                self.show_page_image(self.cached_image(key), key)
+            else:
+                if self.cached_image(preview_key):
+                    self.show_page_image(self.cached_image(preview_key), preview_key)
+                else:
+                    self.show_page_image(None)
+                    if scale > PREVIEW_SCALE * 2:
+                        # Quick low resolution preview first, then the full render
+                        self.renderer.request(
+                            self.render_token, preview_key, self.current_page,
+                            PREVIEW_SCALE, size=(width, height)
+                        )
+                self.renderer.request(self.render_token, key, self.current_page, scale)
+        
+        self.update_page_controls()
     
-    def display_page(self):
-        """Display the first page of PDF"""
-        page = self.doc[0]
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+    def update_page_controls(self):
+        """Update page and zoom indicators and button states"""
+        page_count = len(self.page_rects)
+        self.page_var.set(f"Page {self.current_page + 1} / {page_count}" if page_count else "")
+        self.prev_page_btn.configure(state='normal' if self.current_page > 0 else 'disabled')
+        self.next_page_btn.configure(
+            state='normal' if self.current_page < page_count - 1 else 'disabled'
+        )
+        self.zoom_var.set(f"{round(self.zoom * 100)}%")
+        self.zoom_out_btn.configure(state='normal' if self.zoom > ZOOM_LEVELS[0] else 'disabled')
+        self.zoom_in_btn.configure(state='normal' if self.zoom < ZOOM_LEVELS[-1] else 'disabled')
+    
+    def show_page_image(self, photo, key=None):
+        """Show an image as the page background, or the placeholder for None"""
+        self.photo = photo
+        self.shown_key = key
+        image = photo if photo is not None else ''
+        if self.page_image is None:
+            self.page_image = self.canvas.create_image(0, 0, anchor=tk.NW, image=image)
+        else:
+            self.canvas.itemconfigure(self.page_image, image=image)
+        self.canvas.tag_lower(self.page_image)
+        self.canvas.itemconfigure(
+            self.placeholder, state='normal' if photo is None else 'hidden'
+        )
+    
+    def update_tiles(self):
+        """Show the tiles of a large page that cover the visible region"""
+        if not self.tiled:
+            return
         
-        # Calculate desired window size (80% of screen or PDF size, whichever is smaller)
-        screen_width = self.parent.winfo_screenwidth()
-        screen_height = self.parent.winfo_screenheight()
+        width, height = self.page_pixel_size()
+        left = max(0, int(self.canvas.canvasx(0)) // TILE_SIZE)
+        top = max(0, int(self.canvas.canvasy(0)) // TILE_SIZE)
+        right = min((width - 1) // TILE_SIZE,
+                    int(self.canvas.canvasx(self.canvas.winfo_width())) // TILE_SIZE)
+        bottom = min((height - 1) // TILE_SIZE,
+                     int(self.canvas.canvasy(self.canvas.winfo_height())) // TILE_SIZE)
+        self.visible_tiles = {
+            (self.current_page, self.zoom, column, row)
+            for column in range(left, right + 1)
+            for row in range(top, bottom + 1)
+        }
         
-        pdf_width = pix.width
-        pdf_height = pix.height
+        # Drop canvas items for tiles scrolled out of view, they stay cached
+        for key in list(self.tile_items):
+            if key not in self.visible_tiles:
+                self.canvas.delete(self.tile_items.pop(key))
         
-        window_width = min(int(screen_width * 0.8), pdf_width + 50)  # Add margin for scrollbars
-        window_height = min(int(screen_height * 0.8), pdf_height + 100)  # Add margin for toolbar
+        scale = BASE_SCALE * self.zoom
+        page_rect = self.page_rects[self.current_page]
+        for key in sorted(self.visible_tiles - set(self.tile_items)):
+            photo = self.cached_image(key)
+            if photo is not None:
+                self.add_tile(key, photo)
+            elif key not in self.requested_tiles:
+                _, _, column, row = key
+                clip = fitz.Rect(
+                    column * TILE_SIZE / scale,
+                    row * TILE_SIZE / scale,
+                    (column + 1) * TILE_SIZE / scale,
+                    (row + 1) * TILE_SIZE / scale
+                ) + (page_rect.x0, page_rect.y0, page_rect.x0, page_rect.y0)
+                self.renderer.request(
+                    self.render_token, key, self.current_page, scale, clip=clip & page_rect
+                )
+                self.requested_tiles.add(key)
+    
+    def add_tile(self, key, photo):
+        _, _, column, row = key
+        self.tile_items[key] = self.canvas.create_image(
+            column * TILE_SIZE, row * TILE_SIZE, anchor=tk.NW, image=photo
+        )
+        self.canvas.tag_lower(self.tile_items[key])
+        self.canvas.itemconfigure(self.placeholder, state='hidden')
+    
+    def step_zoom(self, direction):
+        """Move to the next zoom level up (1) or down (-1)"""
+        if direction > 0:
+            levels = [zoom for zoom in ZOOM_LEVELS if zoom > self.zoom]
+            zoom = levels[0] if levels else None
+        else:
+            levels = [zoom for zoom in ZOOM_LEVELS if zoom < self.zoom]
+            zoom = levels[-1] if levels else None
+        if zoom is not None:
+            self.set_zoom(zoom)
+    
+    def set_zoom(self, zoom):
+        """Redisplay the current page and its fields at another zoom"""
+        if self.is_naming_field or zoom == self.zoom or not self.page_rects:
+            return
         
-        # Center the window
-        x = (screen_width - window_width) // 2
-        y = (screen_height - window_height) // 2
+        # Keep the same part of the page in view
+        x_fraction = self.canvas.xview()[0]
+        y_fraction = self.canvas.yview()[0]
         
-        # Set window size and position
-        self.parent.geometry(f"{window_width}x{window_height}+{x}+{y}")
+        for field in self.page_fields():
+            self.remove_field_widgets(field)
         
-        # Display the PDF
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        self.photo = ImageTk.PhotoImage(img)
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
-        self.canvas.configure(scrollregion=self.canvas.bbox(tk.ALL))
+        self.zoom = zoom
+        self.display_page()
+        self.canvas.xview_moveto(x_fraction)
+        self.canvas.yview_moveto(y_fraction)
+        
+        for field in self.page_fields():
+            self.draw_field(field)
+    
+    def show_page(self, page_number):
+        """Switch the editor to another page, with that page's fields"""
+        if self.is_naming_field or not 0 <= page_number < len(self.page_rects):
+            return
+        
+        for field in self.page_fields():
+            self.remove_field_widgets(field)
+        
+        self.current_page = page_number
+        self.display_page()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        
+        for field in self.page_fields():
+            self.draw_field(field)
+        self.mark_overlaps()
+    
+    def page_fields(self):
+        """Fields placed on the current page"""
+        return [field for field in self.form_fields if field['page'] == self.current_page]
     
     def on_canvas_click(self, event):
         """Handle canvas click events"""
@@ -335,6 +951,16 @@ class PDFViewer:
             canvas_x = self.canvas.canvasx(event.x)
             canvas_y = self.canvas.canvasy(event.y)
             
+            # Refuse to stack a new field on top of an existing one
+            existing = self.field_index.hit(
+                self.current_page, self.from_canvas(canvas_x), self.from_canvas(canvas_y)
+            )
+            if existing:
+                self.status_var.set(
+                    f"⚠️ '{existing['name']}' is already here, click an empty spot"
+                )
+                return
+            
             # Get scroll position
             scroll_x = self.canvas.canvasx(0)
             scroll_y = self.canvas.canvasy(0)
@@ -346,7 +972,8 @@ class PDFViewer:
             frame = ttk.Frame(self.canvas)
             frame.place(
                 x=canvas_x - scroll_x,  # Adjust for scroll position
-                y=canvas_y - scroll_y - 55  # Adjust for scroll position and offset
+                y=canvas_y - scroll_y,
+                anchor='sw'  # Sit just above the click point
             )
             
             # Add help label
@@ -380,7 +1007,9 @@ class PDFViewer:
                 if field_name and field_name != "e.g., First Name, Email, Phone...":
                     frame.destroy()
                     self.is_naming_field = False
-                    self.add_input_field(canvas_x, canvas_y, field_name)
+                    self.add_input_field(
+                        self.from_canvas(canvas_x), self.from_canvas(canvas_y), field_name
+                    )
             
             def on_escape(event):
                 frame.destroy()
@@ -406,24 +1035,27 @@ class PDFViewer:
         # Create field
         field = {
             'name': field_name,
+            'page': self.current_page,
             'x': x,
             'y': y,
-            'width': 100,
-            'height': 20,
+            'width': 50,
+            'height': 10,
             'font_size': 11
         }
         
         self.form_fields.append(field)
+        self.field_index.insert(field)
         self.draw_field(field)
         self.is_adding_field = False
         self.status_var.set(f"Current PDF: {os.path.basename(self.pdf_path)}")
+        self.mark_overlaps()
         self.has_unsaved_changes = True
         self.update_buttons_state()
     
     def draw_field(self, field):
         """Draw input field on canvas"""
-        x, y = field['x'], field['y']
-        w, h = field['width'], field['height']
+        x, y = self.to_canvas(field['x']), self.to_canvas(field['y'])
+        w, h = self.to_canvas(field['width']), self.to_canvas(field['height'])
         
         # Draw field rectangle at the loaded coordinates
         field['rect'] = self.canvas.create_rectangle(
@@ -441,11 +1073,12 @@ class PDFViewer:
             tags='draggable'
         )
         
-        # Create entry widget
+        # Create entry widget, placed once it is in view (see refresh_viewport)
         entry = tk.Entry(self.canvas)
-        entry.configure(font=('Segoe UI', field['font_size']))
-        entry.place(x=x+1, y=y+1, width=w-2, height=h-2)
+        entry.configure(font=self.entry_font(field))
         field['entry'] = entry
+        self.viewport_dirty = True
+        self.schedule_redraw()
         
         # Draw resize handles
         self.draw_resize_handles(field)
@@ -460,8 +1093,8 @@ class PDFViewer:
     
     def draw_resize_handles(self, field):
         """Draw handles for resizing the field"""
-        x, y = field['x'], field['y']
-        w, h = field['width'], field['height']
+        x, y = self.to_canvas(field['x']), self.to_canvas(field['y'])
+        w, h = self.to_canvas(field['width']), self.to_canvas(field['height'])
         
         # Width handle (right edge)
         field['width_handle'] = self.canvas.create_text(
@@ -522,27 +1155,29 @@ class PDFViewer:
             
         if self.resize_mode == 'width':
             # Calculate new width
-            delta_x = event.x - self.start_x
-            new_width = max(20, self.original_width + delta_x)
+            delta_x = self.from_canvas(event.x - self.start_x)
+            new_width = max(10, self.original_width + delta_x)
             self.selected_field['width'] = new_width
             
         else:  # height mode
             # Calculate new height
-            delta_y = event.y - self.start_y
-            new_height = max(20, self.original_height + delta_y)
+            delta_y = self.from_canvas(event.y - self.start_y)
+            new_height = max(10, self.original_height + delta_y)
             self.selected_field['height'] = new_height
             
             # Update font size based on height
-            new_font_size = int(new_height * 0.55)  # Approximate ratio
-            self.selected_field['font_size'] = new_font_size
-            
-            # Update entry widget font
-            self.selected_field['entry'].configure(
-                font=('Segoe UI', new_font_size)
-            )
+            new_font_size = int(new_height * 1.1)  # Approximate ratio
+            if new_font_size != self.selected_field['font_size']:
+                self.selected_field['font_size'] = new_font_size
+                
+                # Update entry widget font
+                self.selected_field['entry'].configure(
+                    font=self.entry_font(self.selected_field)
+                )
         
-        # Redraw field
-        self.update_field_display(self.selected_field)
+        # Redraw field on the next frame
+        self.field_index.update(self.selected_field)
+        self.mark_dirty(self.selected_field)
     
     def stop_resize(self, event):
         """Stop resizing field"""
@@ -550,6 +1185,7 @@ class PDFViewer:
         self.canvas.configure(cursor='')  # Reset cursor
         self.canvas.unbind('<B1-Motion>')
         self.canvas.unbind('<ButtonRelease-1>')
+        self.mark_overlaps()
     
     def start_drag(self, event, field):
         """Start dragging a field"""
@@ -564,33 +1200,39 @@ class PDFViewer:
     def drag_field(self, event, field):
         """Move field while dragging"""
         # Calculate movement delta
-        dx = event.x - self.drag_start_x
-        dy = event.y - self.drag_start_y
+        dx = self.from_canvas(event.x - self.drag_start_x)
+        dy = self.from_canvas(event.y - self.drag_start_y)
         
-        # Update field position
-        new_x = self.field_start_x + dx
-        new_y = self.field_start_y + dy
+        # Update field position, aligned with nearby fields and page lines
+        new_x, new_y, guide_x, guide_y = self.field_index.snap(
+            field,
+            self.field_start_x + dx,
+            self.field_start_y + dy,
+            self.page_lines.get(field['page']),
+            self.from_canvas(SNAP_PIXELS)
+        )
         
         # Update field coordinates
         field['x'] = new_x
         field['y'] = new_y
+        self.snap_guides = (guide_x, guide_y)
         
-        # Update display
-        self.update_field_display(field)
+        # Update display on the next frame
+        self.field_index.update(field)
+        self.mark_dirty(field)
     
     def stop_drag(self, event, field):
         """Stop dragging a field"""
         # Reset cursor
         self.canvas.configure(cursor='')
+        self.snap_guides = (None, None)
+        self.draw_guides()
+        self.mark_overlaps()
     
     def update_field_display(self, field):
-        """Update the display of a field"""
-        x, y = field['x'], field['y']
-        w, h = field['width'], field['height']
-        
-        # Get canvas scroll position
-        scroll_x = self.canvas.canvasx(0)
-        scroll_y = self.canvas.canvasy(0)
+        """Update the canvas items of a field"""
+        x, y = self.to_canvas(field['x']), self.to_canvas(field['y'])
+        w, h = self.to_canvas(field['width']), self.to_canvas(field['height'])
         
         # Update rectangle
         self.canvas.coords(field['rect'], x, y, x + w, y + h)
@@ -598,23 +1240,129 @@ class PDFViewer:
         # Update label
         self.canvas.coords(field['label'], x, y - 10)
         
-        # Update entry widget with scroll offset
+        # Update resize handles
+        self.canvas.coords(field['width_handle'], x + w, y + h/2)
+        self.canvas.coords(field['height_handle'], x + w/2, y + h)
+    
+    def place_entry(self, field, scroll_x, scroll_y):
+        """Position a field's entry widget, which does not scroll with the canvas"""
+        x, y = self.to_canvas(field['x']), self.to_canvas(field['y'])
+        w, h = self.to_canvas(field['width']), self.to_canvas(field['height'])
         field['entry'].place(
             x=x - scroll_x + 1,
             y=y - scroll_y + 1,
             width=w-2,
             height=h-2
         )
+    
+    def mark_dirty(self, field):
+        """Redraw a field on the next frame"""
+        self.dirty_fields[id(field)] = field
+        self.schedule_redraw()
+    
+    def schedule_redraw(self):
+        """Coalesce redraw requests into one update per frame"""
+        if self.redraw_job is None:
+            self.redraw_job = self.parent.after(FRAME_MS, self.flush_redraw)
+    
+    def flush_redraw(self):
+        """Redraw changed fields and the fields in view"""
+        self.redraw_job = None
+        dirty, self.dirty_fields = self.dirty_fields, {}
+        for field in dirty.values():
+            if 'rect' in field:
+                self.update_field_display(field)
+        self.draw_guides()
+        self.refresh_viewport(dirty)
+    
+    def draw_guides(self):
+        """Show the alignment guides the dragged field snapped to"""
+        for item in self.guide_items:
+            self.canvas.delete(item)
+        self.guide_items = []
         
-        # Update resize handles
-        self.canvas.coords(field['width_handle'], x + w, y + h/2)
-        self.canvas.coords(field['height_handle'], x + w/2, y + h)
+        guide_x, guide_y = self.snap_guides
+        if guide_x is None and guide_y is None:
+            return
+        width, height = self.page_pixel_size()
+        if guide_x is not None:
+            x = self.to_canvas(guide_x)
+            self.guide_items.append(self.canvas.create_line(
+                x, 0, x, height, fill='#e67e22', dash=(4, 2), tags='guide'
+            ))
+        if guide_y is not None:
+            y = self.to_canvas(guide_y)
+            self.guide_items.append(self.canvas.create_line(
+                0, y, width, y, fill='#e67e22', dash=(4, 2), tags='guide'
+            ))
+    
+    def mark_overlaps(self):
+        """Outline fields on the current page that overlap another field in red"""
+        overlapping = None
+        for field in self.page_fields():
+            if 'rect' not in field:
+                continue
+            others = self.field_index.overlaps(field)
+            self.canvas.itemconfigure(field['rect'], outline='red' if others else 'blue')
+            if others and overlapping is None:
+                overlapping = (field, others[0])
+        
+        if overlapping:
+            field, other = overlapping
+            self.status_var.set(f"⚠️ Field '{field['name']}' overlaps '{other['name']}'")
+    
+    def refresh_viewport(self, dirty):
+        """Place entry widgets of fields in view and hide the rest.
+        
+        Canvas items scroll by themselves; only entry widgets need placing,
+        and only for the fields the spatial index finds in the viewport.
+        """
+        scroll = (self.canvas.canvasx(0), self.canvas.canvasy(0))
+        scrolled = scroll != self.placed_scroll
+        if not (scrolled or dirty or self.viewport_dirty):
+            return
+        self.placed_scroll = scroll
+        self.viewport_dirty = False
+        self.update_tiles()
+        
+        scroll_x, scroll_y = scroll
+        visible = {
+            id(field): field
+            for field in self.field_index.query(
+                self.current_page,
+                self.from_canvas(scroll_x),
+                self.from_canvas(scroll_y),
+                self.from_canvas(scroll_x + self.canvas.winfo_width()),
+                self.from_canvas(scroll_y + self.canvas.winfo_height())
+            )
+            if 'entry' in field
+        }
+        
+        for key, field in list(self.placed_entries.items()):
+            if key not in visible:
+                field['entry'].place_forget()
+                del self.placed_entries[key]
+        
+        for key, field in visible.items():
+            if scrolled or key in dirty or key not in self.placed_entries:
+                self.place_entry(field, scroll_x, scroll_y)
+                self.placed_entries[key] = field
+    
+    def remove_field_widgets(self, field):
+        """Delete a field's canvas items and entry widget"""
+        if 'entry' in field:
+            field['entry'].destroy()
+        for key in ('rect', 'label', 'width_handle', 'height_handle'):
+            if key in field:
+                self.canvas.delete(field.pop(key))
+        field.pop('entry', None)
+        self.placed_entries.pop(id(field), None)
+        self.dirty_fields.pop(id(field), None)
     
     def on_canvas_scroll(self, *args):
         """Handle canvas scroll events"""
-        # Update all field positions
-        for field in self.form_fields:
-            self.update_field_display(field)
+        # Update field positions on the next frame
+        self.update_all_fields()
     
     def load_fields(self):
         """Load field configuration from JSON"""
@@ -637,19 +1385,12 @@ class PDFViewer:
         
         try:
             # Load field configuration
-            with open(json_path, 'r') as f:
-                fields = json.load(f)
+            # Older canvas pixel files are converted to points
+            fields = load_field_config(json_path)
             
             # Clear existing fields
-            for field in self.form_fields:
-                if 'entry' in field:
-                    field['entry'].destroy()
-                self.canvas.delete(field['rect'])
-                self.canvas.delete(field['label'])
-                if 'width_handle' in field:
-                    self.canvas.delete(field['width_handle'])
-                if 'height_handle' in field:
-                    self.canvas.delete(field['height_handle'])
+            for field in self.page_fields():
+                self.remove_field_widgets(field)
             
             # Reset form fields list
             self.form_fields = []
@@ -658,16 +1399,23 @@ class PDFViewer:
             for field_config in fields:
                 field = {
                     'name': field_config['name'],
+                    'page': field_config.get('page', 0),
                     'x': field_config['x'],
                     'y': field_config['y'],
                     'width': field_config['width'],
                     'height': field_config['height'],
                     'font_size': field_config['font_size']
                 }
+                for key in FIELD_OPTIONS:
+                    if key in field_config:
+                        field[key] = field_config[key]
                 self.form_fields.append(field)
-                self.draw_field(field)
+                if field['page'] == self.current_page:
+                    self.draw_field(field)
+            self.field_index.rebuild(self.form_fields)
             
             self.status_var.set(f"✅ Loaded {len(fields)} fields from {os.path.basename(json_path)}")
+            self.mark_overlaps()
             self.has_unsaved_changes = False  # Reset changes flag
             self.update_buttons_state()  # Disable save button
             
@@ -700,9 +1448,9 @@ class PDFViewer:
         self.update_all_fields()
     
     def update_all_fields(self):
-        """Update all field positions"""
-        for field in self.form_fields:
-            self.update_field_display(field)
+        """Update positions of the fields in view on the next frame"""
+        self.viewport_dirty = True
+        self.schedule_redraw()
     
     def update_buttons_state(self):
         """Update state of all buttons based on current conditions"""
@@ -712,8 +1460,14 @@ class PDFViewer:
         else:
             self.save_btn.configure(state='disabled')
         
+        # Update detect button
+        if self.detected_fields:
+            self.detect_btn.configure(state='normal')
+        else:
+            self.detect_btn.configure(state='disabled')
+        
         # Update process button
-        if self.form_fields:
+        if self.form_fields and self.batch_process is None:
             self.process_btn.configure(state='normal')
         else:
             self.process_btn.configure(state='disabled')
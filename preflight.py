@@ -0,0 +1,107 @@
+"""Pre-flight check of CSV data against the fields it fills, before rendering.
+
+Every row is checked for missing values, bytes that are not valid UTF-8,
+values that do not fit their field and characters the field's font has
+no glyph for. Each distinct value of a field is checked once, so the
+values repeated throughout large files (cities, dates, ...) cost a
+dictionary lookup per row.
+"""
+
+# Problems found, by kind, as described in reports
+KINDS = {
+    'columns': "more values than header columns",
+    'missing': "missing values",
+    'encoding': "bytes that are not valid UTF-8",
+    'font': "characters the font has no glyph for",
+    'fit': "values that do not fit the field",
+}
+# Rows listed per field and kind of problem
+MAX_EXAMPLES = 5
+# Distinct values remembered per field before starting over
+MAX_CHECKED_VALUES = 65536
+
+
+def undecodable(value):
+    """Whether a value read with errors='surrogateescape' held bytes that are not UTF-8"""
+    return any('\udc80' <= char <= '\udcff' for char in value)
+
+
+def shorten(value, length=24):
+    return value if len(value) <= length else value[:length - 1] + '…'
+
+
+def value_problems(value, layout):
+    """(kind, detail) problems of one value; layout is None for form widgets"""
+    if value is None:
+        return [('missing', "row too short")]
+    if not value.strip():
+        return [('missing', '')]
+    # Replacement characters are bytes that were not UTF-8 further upstream
+    if undecodable(value) or '\ufffd' in value:
+        return [('encoding', '')]
+    if layout is None:
+        return []
+
+    problems = []
+    missing = layout.metrics.missing(value)
+    if missing:
+        problems.append(('font', ' '.join(sorted(missing))))
+    if layout.overflows(value):
+        problems.append(('fit', repr(shorten(value))))
+    return problems
+
+
+class PreflightReport:
+    """Problems found in a CSV file, counted per field and kind of problem"""
+    def __init__(self):
+        self.rows = 0
+        self.counts = {}
+        self.examples = {}
+
+    @property
+    def ok(self):
+        return not self.counts
+
+    def add(self, i, field, kind, detail=''):
+        key = (field, kind)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        examples = self.examples.setdefault(key, [])
+        if len(examples) < MAX_EXAMPLES:
+            examples.append((i, detail))
+
+    def summary(self):
+        if self.ok:
+            return f"Checked {self.rows} rows: no problems found"
+        lines = [f"Checked {self.rows} rows, found problems in these fields:"]
+        for (field, kind), count in sorted(self.counts.items(), key=lambda item: str(item[0])):
+            examples = ', '.join(
+                f"{i} ({detail})" if detail else str(i) for i, detail in self.examples[(field, kind)]
+            )
+            more = ', ...' if count > MAX_EXAMPLES else ''
+            lines.append(f"  {field}: {count} rows with {KINDS[kind]} (rows {examples}{more})")
+        return "\n".join(lines)
+
+
+def check_rows(rows, fields):
+    """Check (index, row) pairs, returns a PreflightReport.
+
+    fields are (name, layout) pairs, with layout None for fields that
+    fill form widgets.
+    """
+    report = PreflightReport()
+    checked = {name: {} for name, _ in fields}
+    for i, row in rows:
+        report.rows += 1
+        if None in row:
+            report.add(i, '(row)', 'columns', f"{len(row[None])} extra")
+        for name, layout in fields:
+            value = row.get(name)
+            seen = checked[name]
+            problems = seen.get(value)
+            if problems is None:
+                if len(seen) >= MAX_CHECKED_VALUES:
+                    seen.clear()
+                problems = seen[value] = value_problems(value, layout)
+            for kind, detail in problems:
+                report.add(i, name, kind, detail)
+    return report
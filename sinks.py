@@ -0,0 +1,229 @@
+"""Destinations for rendered PDFs, written behind the rendering.
+
+A sink takes finished outputs as (name, bytes): a directory, a ZIP or
+tar archive streamed as it grows, or a tar stream on standard output.
+WriteBehind hands outputs to a sink from I/O threads through a bounded
+queue, so rendering goes on while earlier outputs are being written.
+"""
+import io
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+
+# Outputs rendered but not yet written; rendering waits when it is full
+WRITE_QUEUE_SIZE = 32
+# Threads writing files concurrently to a directory
+IO_THREADS = 4
+
+
+def write_atomic(path, content):
+    """Write bytes via a temporary file, so a partial file never has the final name.
+
+    The data is synced before the rename, so a row recorded as completed
+    in the checkpoint cannot come back as an empty or partial file after
+    a crash of the machine.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class DirectorySink:
+    """Every output as its own file in a directory, names may include subdirectories"""
+    threads = IO_THREADS
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.directories = {path}
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        directory = os.path.dirname(path)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+        write_atomic(path, content)
+
+    def close(self):
+        pass
+
+
+class ArchiveSink:
+    """Outputs appended to a ZIP or tar archive as they arrive.
+
+    Entries are written one after another, so the archive can go to a
+    pipe; PDFs are compressed already and are stored as they are.
+    """
+    threads = 1
+
+    def __init__(self, path, fileobj=None):
+        self.path = path
+        self.file = fileobj or open(path, 'wb')
+        self.owns_file = fileobj is None
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self.archive = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_STORED)
+        else:
+            mode = 'w|gz' if lower.endswith(('.tar.gz', '.tgz')) else 'w|'
+            self.archive = tarfile.open(fileobj=self.file, mode=mode)
+
+    def write(self, name, content):
+        if isinstance(self.archive, zipfile.ZipFile):
+            entry = zipfile.ZipInfo(name, time.localtime()[:6])
+            self.archive.writestr(entry, content)
+        else:
+            entry = tarfile.TarInfo(name)
+            entry.size = len(content)
+            entry.mtime = int(time.time())
+            self.archive.addfile(entry, io.BytesIO(content))
+
+    def close(self):
+        self.archive.close()
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class StdoutSink(ArchiveSink):
+    """Outputs as a tar stream on standard output, e.g. piped to tar x.
+
+    The stream gets its own handle on standard output, which is pointed
+    at standard error meanwhile, so messages printed by libraries cannot
+    end up inside the archive.
+    """
+    def __init__(self):
+        sys.stdout.flush()
+        self.saved_fd = os.dup(1)
+        os.dup2(2, 1)
+        super().__init__('-.tar', fileobj=os.fdopen(os.dup(self.saved_fd), 'wb'))
+        self.owns_file = True
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            sys.stdout.flush()
+            os.dup2(self.saved_fd, 1)
+            os.close(self.saved_fd)
+
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def is_directory(target):
+    """Whether an output path names a directory rather than an archive or '-'"""
+    return target != '-' and not target.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def open_sink(target):
+    """Sink for an output path: '-' for standard output, an archive by suffix, or a directory"""
+    if target == '-':
+        return StdoutSink()
+    if is_directory(target):
+        return DirectorySink(target)
+    return ArchiveSink(target)
+
+
+class WriteBehind:
+    """Bounded queue of outputs drained into a sink by I/O threads.
+
+    put blocks while the queue is full, which keeps memory bounded when
+    the sink is slower than rendering. Outputs carry the row indexes
+    they hold; completed returns them once written, in the order they
+    were put when ordered is set. A failed write is raised from the next
+    put, completed or drain call.
+    """
+    def __init__(self, sink, ordered=True, size=WRITE_QUEUE_SIZE, timer=None):
+        self.sink = sink
+        self.ordered = ordered
+        self.timer = timer
+        self.queue = queue.Queue(size)
+        # Outputs put and not yet reported, as [indexes, written]
+        self.jobs = deque()
+        self.lock = threading.Condition()
+        self.error = None
+        self.write_seconds = 0.0
+        self.writes = 0
+        self.threads = [
+            threading.Thread(target=self._drain_queue, daemon=True)
+            for _ in range(max(1, sink.threads))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _drain_queue(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            job, name, content = item
+            start = time.perf_counter()
+            try:
+                if self.error is None:
+                    self.sink.write(name, content)
+            except BaseException as e:
+                self.error = e
+            with self.lock:
+                self.write_seconds += time.perf_counter() - start
+                self.writes += 1
+                job[1] = True
+                self.lock.notify_all()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, name, content, indexes):
+        """Queue an output for writing, waiting while the queue is full"""
+        self._check()
+        job = [indexes, False]
+        with self.lock:
+            self.jobs.append(job)
+        start = time.perf_counter()
+        self.queue.put((job, name, content))
+        if self.timer:
+            self.timer.record('queue', time.perf_counter() - start)
+
+    def completed(self, wait=False):
+        """Indexes of the rows written since the last call.
+
+        With wait set, blocks until every output put so far is written.
+        """
+        done = []
+        with self.lock:
+            while True:
+                if self.ordered:
+                    while self.jobs and self.jobs[0][1]:
+                        done.extend(self.jobs.popleft()[0])
+                else:
+                    for job in [job for job in self.jobs if job[1]]:
+                        self.jobs.remove(job)
+                        done.extend(job[0])
+                if not (wait and self.jobs) or self.error is not None:
+                    break
+                self.lock.wait()
+        self._check()
+        return done
+
+    def drain(self):
+        """Wait for every queued output, returns the indexes not reported yet"""
+        return self.completed(wait=True)
+
+    def close(self):
+        """Let the I/O threads finish the queued outputs; the sink stays open"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.timer and self.writes:
+            self.timer.record('write', self.write_seconds, self.writes)